@@ -0,0 +1,480 @@
+"""In-memory stand-in for the parts of Maya the scatter tool uses.
+
+install() registers fake maya.cmds, maya.api.OpenMaya, maya.OpenMayaUI,
+pymel, PySide2 and shiboken2 modules so scatter.py can be imported and
+driven outside of Maya, e.g. by scatter_benchmark.py. Every cmds and
+OpenMaya call is counted in SCENE.calls.
+"""
+import collections
+import re
+import sys
+import types
+
+import numpy as np
+
+COMPONENT_RE = re.compile(r'^(?P<node>[^.]+)\.(?P<attr>.+)$')
+
+
+class FakeScene(object):
+    """Meshes, nodes, selection and call counts of the fake session"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.meshes = {}
+        self.nodes = {}
+        self.selection = []
+        self.calls = collections.Counter()
+        self.callbacks = {}
+        self._names = collections.Counter()
+
+    def unique_name(self, base):
+        base = base.rstrip('0123456789') or base
+        while True:
+            self._names[base] += 1
+            name = '{}{}'.format(base, self._names[base])
+            if name not in self.nodes and name not in self.meshes:
+                return name
+
+    def add_grid_mesh(self, name, vertex_count):
+        """Add a bumpy square grid mesh with about vertex_count vertices"""
+        side = max(int(round(vertex_count ** 0.5)), 2)
+        grid_x, grid_z = np.meshgrid(np.arange(side, dtype=np.float64),
+                                     np.arange(side, dtype=np.float64))
+        grid_y = 0.5 * np.sin(grid_x * 0.3) * np.cos(grid_z * 0.2)
+        points = np.column_stack((grid_x.ravel(), grid_y.ravel(),
+                                  grid_z.ravel()))
+
+        corner = np.arange(side * side).reshape(side, side)[:-1, :-1].ravel()
+        quads = np.column_stack((corner, corner + 1, corner + side + 1,
+                                 corner + side))
+        normals = np.zeros_like(points)
+        for offset in range(4):
+            prev_pt = points[quads[:, offset - 1]]
+            this_pt = points[quads[:, offset]]
+            next_pt = points[quads[:, (offset + 1) % 4]]
+            np.add.at(normals, quads[:, offset],
+                      np.cross(next_pt - this_pt, prev_pt - this_pt))
+        normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+
+        uvs = np.column_stack((grid_x.ravel(), grid_z.ravel())) / (side - 1)
+        self.meshes[name] = {'points': points, 'quads': quads,
+                             'normals': normals, 'uvs': uvs,
+                             'color_sets': {}}
+        self.nodes[name] = {'type': 'mesh'}
+        return name
+
+
+SCENE = FakeScene()
+
+
+def counted(module_name, func):
+    def wrapper(*args, **kwargs):
+        SCENE.calls[module_name + '.' + func.__name__] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+# maya.cmds -------------------------------------------------------------
+
+def ls(*args, **kwargs):
+    if args:
+        return [name for name in _as_list(args[0]) if name in SCENE.nodes]
+    if kwargs.get('selection'):
+        return list(SCENE.selection)
+    if kwargs.get('transforms'):
+        names = [name for name, node in SCENE.nodes.items()
+                 if node['type'] == 'transform']
+        return names[:kwargs['head']] if kwargs.get('head') else names
+    return list(SCENE.nodes)
+
+
+def select(items, replace=True, **kwargs):
+    SCENE.selection = _as_list(items)
+
+
+def polyListComponentConversion(items, toVertex=False, toFace=False,
+                                **kwargs):
+    kind, count_key = ('vtx', 'points') if toVertex else ('f', 'quads')
+    result = []
+    for item in _as_list(items):
+        mesh = item.split('.')[0]
+        if mesh not in SCENE.meshes:
+            continue
+        if '.' not in item or not toVertex:
+            count = len(SCENE.meshes[mesh][count_key])
+            result.append('{}.{}[0:{}]'.format(mesh, kind, count - 1))
+        else:
+            result.append(item)
+    return result
+
+
+def polyEvaluate(mesh, vertex=False, face=False, **kwargs):
+    data = SCENE.meshes[mesh]
+    return len(data['points']) if vertex else len(data['quads'])
+
+
+def instance(source, **kwargs):
+    name = SCENE.unique_name(source)
+    SCENE.nodes[name] = {'type': 'transform', 'instance_of': source}
+    return [name]
+
+
+def xform(nodes, query=False, **kwargs):
+    for node in _as_list(nodes):
+        SCENE.nodes[node].update(kwargs)
+
+
+def group(nodes, name='group', **kwargs):
+    group_name = name if name not in SCENE.nodes else SCENE.unique_name(name)
+    SCENE.nodes[group_name] = {'type': 'transform',
+                               'children': _as_list(nodes)}
+    return group_name
+
+
+def parent(nodes, new_parent, **kwargs):
+    nodes = _as_list(nodes)
+    SCENE.nodes[new_parent].setdefault('children', []).extend(nodes)
+    return nodes
+
+
+def delete(nodes, **kwargs):
+    deleted = set()
+    for node in _as_list(nodes):
+        entry = SCENE.nodes.pop(node, None)
+        if entry:
+            deleted.add(node)
+            for child in entry.get('children', []):
+                SCENE.nodes.pop(child, None)
+    for entry in SCENE.nodes.values():
+        if entry.get('children'):
+            entry['children'] = [child for child in entry['children']
+                                 if child not in deleted]
+
+
+def objExists(node):
+    return node in SCENE.nodes
+
+
+def sets(items, edit=False, e=False, forceElement=None, **kwargs):
+    for item in _as_list(items):
+        SCENE.nodes[item]['shading_group'] = forceElement
+
+
+def listRelatives(node, shapes=False, children=False, **kwargs):
+    if children:
+        return list(SCENE.nodes.get(node, {}).get('children', []))
+    if node in SCENE.nodes:
+        return [node + 'Shape']
+    return []
+
+
+def listConnections(plug, type=None, **kwargs):
+    if type != 'shadingEngine':
+        return []
+    node = _as_list(plug)[0].split('.')[0]
+    if node in SCENE.nodes and SCENE.nodes[node]['type'] == 'material':
+        return [node + 'SG']
+    return ['initialShadingGroup']
+
+
+def normalConstraint(target, node, **kwargs):
+    name = SCENE.unique_name('normalConstraint')
+    SCENE.nodes[name] = {'type': 'normalConstraint', 'target': target}
+    return [name]
+
+
+def particle(position=None, name='particle', **kwargs):
+    transform = SCENE.unique_name(name)
+    SCENE.nodes[transform] = {'type': 'transform',
+                              'points': len(position or [])}
+    SCENE.nodes[transform + 'Shape'] = {'type': 'particle'}
+    return [transform, transform + 'Shape']
+
+
+def particleInstancer(shape, **kwargs):
+    name = SCENE.unique_name('instancer')
+    SCENE.nodes[name] = {'type': 'instancer', 'particles': shape}
+    return name
+
+
+def setAttr(plug, *args, **kwargs):
+    match = COMPONENT_RE.match(plug)
+    SCENE.nodes[match.group('node')][match.group('attr')] = args
+
+
+def addAttr(node, **kwargs):
+    pass
+
+
+def saveInitialState(node, **kwargs):
+    pass
+
+
+def getAttr(plug, time=None, **kwargs):
+    match = COMPONENT_RE.match(plug)
+    value = SCENE.nodes[match.group('node')].get(match.group('attr'))
+    return value(time) if callable(value) else value
+
+
+def colorAtPoint(texture, output='RGB', coordU=(), coordV=(), **kwargs):
+    image = SCENE.nodes[texture]['image']
+    rows = np.clip((np.array(coordV) * (len(image) - 1)).round(), 0,
+                   len(image) - 1).astype(np.int64)
+    cols = np.clip((np.array(coordU) * (len(image[0]) - 1)).round(), 0,
+                   len(image[0]) - 1).astype(np.int64)
+    texels = image[rows, cols]
+    return (texels[:, 3:] if output == 'A' else texels[:, :3]).ravel().tolist()
+
+
+def nodeType(node, **kwargs):
+    return SCENE.nodes[node]['type']
+
+
+def undoInfo(**kwargs):
+    pass
+
+
+def refresh(**kwargs):
+    pass
+
+
+def create_texture(name, image, path=''):
+    """Add a file texture node sampling an (H,W,4) RGBA image"""
+    SCENE.nodes[name] = {'type': 'file', 'image': np.asarray(image),
+                         'fileTextureName': path}
+    return name
+
+
+def create_camera(name, world_matrix, focal_length=35.0):
+    """Add a camera; world_matrix may be a function of the frame"""
+    SCENE.nodes[name] = {'type': 'transform', 'worldMatrix': world_matrix,
+                         'focalLength': focal_length,
+                         'horizontalFilmAperture': 1.417,
+                         'verticalFilmAperture': 0.945,
+                         'nearClipPlane': 0.1, 'farClipPlane': 10000.0}
+    return name
+
+
+def create_material(name):
+    """Add a material node so listConnections finds its shading group"""
+    SCENE.nodes[name] = {'type': 'material'}
+    SCENE.nodes[name + 'SG'] = {'type': 'shadingEngine'}
+    return name
+
+
+CMDS_FUNCTIONS = [ls, select, polyListComponentConversion, polyEvaluate,
+                  instance, xform, group, parent, delete, objExists, sets,
+                  listRelatives, listConnections, normalConstraint, particle,
+                  particleInstancer, setAttr, getAttr, addAttr,
+                  saveInitialState, colorAtPoint, nodeType, undoInfo,
+                  refresh]
+
+
+# maya.api.OpenMaya -----------------------------------------------------
+
+Vector = collections.namedtuple('Vector', 'x y z')
+Color = collections.namedtuple('Color', 'r g b a')
+
+
+class MSpace(object):
+    kWorld = 4
+
+
+class MDagPath(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def inclusiveMatrix(self):
+        return [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0,
+                0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self.names = []
+
+    def add(self, name):
+        self.names.append(name)
+
+    def getDagPath(self, idx):
+        return MDagPath(self.names[idx])
+
+
+class MFnMesh(object):
+
+    def __init__(self, dag_path):
+        self._dag_path = dag_path
+        self._data = SCENE.meshes[dag_path.name]
+
+    @property
+    def numVertices(self):
+        return len(self._data['points'])
+
+    @property
+    def numPolygons(self):
+        return len(self._data['quads'])
+
+    @property
+    def numFaceVertices(self):
+        return self._data['quads'].size
+
+    def dagPath(self):
+        return self._dag_path
+
+    def object(self):
+        return self._dag_path.name
+
+    def getPoint(self, idx, space):
+        SCENE.calls['api.getPoint'] += 1
+        return Vector(*self._data['points'][idx].tolist())
+
+    def getPoints(self, space):
+        SCENE.calls['api.getPoints'] += 1
+        return [Vector(*point) for point in self._data['points'].tolist()]
+
+    def getVertexNormals(self, angle_weighted, space):
+        SCENE.calls['api.getVertexNormals'] += 1
+        return [Vector(*normal) for normal in self._data['normals'].tolist()]
+
+    def getVertexColors(self, color_set=None):
+        SCENE.calls['api.getVertexColors'] += 1
+        colors = self._data['color_sets'].get(color_set)
+        if colors is None:
+            colors = -np.ones((self.numVertices, 4))
+        return [Color(*color) for color in colors.tolist()]
+
+    def getUVs(self, uv_set=None):
+        SCENE.calls['api.getUVs'] += 1
+        uvs = self._data['uvs']
+        return uvs[:, 0].tolist(), uvs[:, 1].tolist()
+
+    def getAssignedUVs(self, uv_set=None):
+        SCENE.calls['api.getAssignedUVs'] += 1
+        quads = self._data['quads']
+        return [4] * len(quads), quads.ravel().tolist()
+
+    def getVertices(self):
+        SCENE.calls['api.getVertices'] += 1
+        quads = self._data['quads']
+        return [4] * len(quads), quads.ravel().tolist()
+
+    def getTriangles(self):
+        SCENE.calls['api.getTriangles'] += 1
+        quads = self._data['quads']
+        triangles = np.column_stack((quads[:, 0], quads[:, 1], quads[:, 2],
+                                     quads[:, 0], quads[:, 2], quads[:, 3]))
+        return [2] * len(quads), triangles.ravel().tolist()
+
+
+class MNodeMessage(object):
+
+    @staticmethod
+    def addNodeDirtyCallback(node, func):
+        callback_id = len(SCENE.callbacks) + 1
+        SCENE.callbacks[callback_id] = (node, func)
+        return callback_id
+
+
+class MMessage(object):
+
+    @staticmethod
+    def removeCallback(callback_id):
+        SCENE.callbacks.pop(callback_id, None)
+
+
+def edit_mesh(name):
+    """Fire the dirty callbacks of a mesh as an edit in Maya would"""
+    for node, func in list(SCENE.callbacks.values()):
+        if node == name:
+            func(node, None)
+
+
+# PySide2 ---------------------------------------------------------------
+
+def _slot(*types_):
+    return lambda func: func
+
+
+class _QObject(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class _Qt(object):
+    WindowContextHelpButtonHint = 0
+
+
+class _QEvent(object):
+    (MouseButtonPress, MouseButtonRelease, MouseButtonDblClick, Wheel,
+     KeyPress, KeyRelease, ShortcutOverride, Shortcut, Drop) = range(9)
+
+
+def _qt_modules():
+    qt_core = types.ModuleType('PySide2.QtCore')
+    qt_core.Slot = _slot
+    qt_core.Signal = lambda *types_: None
+    qt_core.QObject = _QObject
+    qt_core.QEvent = _QEvent
+    qt_core.QThread = _QObject
+    qt_core.QTimer = _QObject
+    qt_core.Qt = _Qt
+    qt_widgets = types.ModuleType('PySide2.QtWidgets')
+    qt_widgets.QDialog = _QObject
+    qt_widgets.QWidget = _QObject
+    return qt_core, qt_widgets
+
+
+def install():
+    """Register the stand-in modules under their Maya names"""
+    cmds = types.ModuleType('maya.cmds')
+    for func in CMDS_FUNCTIONS:
+        setattr(cmds, func.__name__, counted('cmds', func))
+
+    open_maya = types.ModuleType('maya.api.OpenMaya')
+    open_maya.MSpace = MSpace
+    open_maya.MSelectionList = MSelectionList
+    open_maya.MFnMesh = MFnMesh
+    open_maya.MNodeMessage = MNodeMessage
+    open_maya.MMessage = MMessage
+
+    maya = types.ModuleType('maya')
+    maya_api = types.ModuleType('maya.api')
+    maya_ui = types.ModuleType('maya.OpenMayaUI')
+    maya.cmds, maya.api, maya.OpenMayaUI = cmds, maya_api, maya_ui
+    maya_api.OpenMaya = open_maya
+
+    pymel = types.ModuleType('pymel')
+    pymel_core = types.ModuleType('pymel.core')
+    pymel_system = types.ModuleType('pymel.core.system')
+    pymel.core, pymel_core.system = pymel_core, pymel_system
+
+    qt_core, qt_widgets = _qt_modules()
+    pyside = types.ModuleType('PySide2')
+    pyside.QtCore, pyside.QtWidgets = qt_core, qt_widgets
+    shiboken = types.ModuleType('shiboken2')
+    shiboken.wrapInstance = lambda *args: None
+
+    sys.modules.update({'maya': maya, 'maya.cmds': cmds,
+                        'maya.api': maya_api,
+                        'maya.api.OpenMaya': open_maya,
+                        'maya.OpenMayaUI': maya_ui,
+                        'pymel': pymel, 'pymel.core': pymel_core,
+                        'pymel.core.system': pymel_system,
+                        'PySide2': pyside, 'PySide2.QtCore': qt_core,
+                        'PySide2.QtWidgets': qt_widgets,
+                        'shiboken2': shiboken})
+    return SCENE
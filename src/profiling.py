@@ -0,0 +1,106 @@
+import collections
+import contextlib
+import json
+import logging
+import time
+
+import maya.cmds as cmds
+
+log = logging.getLogger(__name__)
+
+_CALLS = collections.Counter()
+_ORIGINALS = {}
+_users = 0
+
+
+def _counting(name, func):
+    def wrapper(*args, **kwargs):
+        _CALLS[name] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+def _count_maya_calls():
+    """Wrap every maya.cmds command so calls to it are counted"""
+    global _users
+    _users += 1
+    if _users > 1:
+        return
+    for name in dir(cmds):
+        func = getattr(cmds, name)
+        if callable(func) and not name.startswith('_'):
+            _ORIGINALS[name] = func
+            setattr(cmds, name, _counting(name, func))
+
+
+def _restore_maya_calls():
+    global _users
+    _users -= 1
+    if _users > 0:
+        return
+    for name, func in _ORIGINALS.items():
+        setattr(cmds, name, func)
+    _ORIGINALS.clear()
+
+
+class Profiler(object):
+    """Opt-in timing, item counts and Maya call counts per stage.
+
+    Stages run several times (e.g. once per chunk) are accumulated into a
+    single record. Nothing is recorded until enable() is called.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = False
+        self.stages = collections.OrderedDict()
+
+    def enable(self):
+        if not self.enabled:
+            _count_maya_calls()
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            _restore_maya_calls()
+            self.enabled = False
+
+    def reset(self):
+        self.stages.clear()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the wrapped block; set 'items' on the yielded dict"""
+        current = {'items': None}
+        if not self.enabled:
+            yield current
+            return
+
+        calls_before = sum(_CALLS.values())
+        start = time.time()
+        try:
+            yield current
+        finally:
+            seconds = time.time() - start
+            maya_calls = sum(_CALLS.values()) - calls_before
+            record = self.stages.setdefault(
+                name, {'seconds': 0.0, 'items': None, 'maya_calls': 0,
+                       'runs': 0})
+            record['seconds'] += seconds
+            record['maya_calls'] += maya_calls
+            record['runs'] += 1
+            if current['items'] is not None:
+                record['items'] = (record['items'] or 0) + current['items']
+            log.info("%s %s: %.3fs, %s items, %d Maya calls", self.name,
+                     name, seconds, current['items'], maya_calls)
+
+    def as_dict(self):
+        """Return the recorded stages as plain data"""
+        return {'name': self.name,
+                'stages': [dict(record, stage=name)
+                           for name, record in self.stages.items()]}
+
+    def write_json(self, path):
+        with open(path, 'w') as json_file:
+            json.dump(self.as_dict(), json_file, indent=2)
@@ -1,10 +1,22 @@
+import contextlib
+
 import maya.cmds as cmds
 import maya.OpenMayaUI as omui
 import pymel.core as pm
-import random
+import numpy as np
+import time
 from PySide2 import QtWidgets, QtCore
 from shiboken2 import wrapInstance
 
+import profiling
+import scatter_camera
+import scatter_cache
+import scatter_density
+import scatter_engine
+import scatter_pointcloud
+import scatter_sampling
+import scatter_shards
+
 
 def maya_main_window():
     """Return maya main window widget"""
@@ -12,6 +24,89 @@ def maya_main_window():
     return wrapInstance(long(main_window), QtWidgets.QWidget)
 
 
+def parse_palette(text):
+    """Return [(name, weight)] from text like 'rock_mat:3, moss_mat'"""
+    palette = []
+    for entry in text.split(','):
+        name, _, weight = entry.strip().partition(':')
+        if name:
+            palette.append((name.strip(), float(weight) if weight else 1.0))
+    return palette
+
+
+def format_palette(palette):
+    """Return the text form of a material palette"""
+    return ', '.join('{}:{:g}'.format(name, weight)
+                     for name, weight in palette)
+
+
+@contextlib.contextmanager
+def suspended_scene_updates(chunk_name):
+    """Group scene edits into one undo step and pause viewport refresh"""
+    cmds.undoInfo(openChunk=True, chunkName=chunk_name)
+    cmds.refresh(suspend=True)
+    try:
+        yield
+    finally:
+        cmds.refresh(suspend=False)
+        cmds.undoInfo(closeChunk=True)
+
+
+def load_surface(mesh):
+    """Return points, triangles, triangle faces and areas of a mesh"""
+    points, triangles, tri_faces = scatter_sampling.fetch_triangles(mesh)
+    areas = scatter_sampling.triangle_areas(points, triangles)
+    return points, triangles, tri_faces, areas
+
+
+def shading_group_of(material):
+    """Return the shading group a material drives"""
+    groups = cmds.listConnections(material + '.outColor',
+                                  type='shadingEngine') or []
+    return groups[0] if groups else material + 'SG'
+
+
+class InputBlocker(QtCore.QObject):
+    """Application event filter dropping input outside one window.
+
+    Installed while a scatter is applied chunk by chunk, so nothing the
+    artist does in Maya, such as an Undo, lands in the open undo chunk.
+    """
+
+    BLOCKED = (QtCore.QEvent.MouseButtonPress,
+               QtCore.QEvent.MouseButtonRelease,
+               QtCore.QEvent.MouseButtonDblClick, QtCore.QEvent.Wheel,
+               QtCore.QEvent.KeyPress, QtCore.QEvent.KeyRelease,
+               QtCore.QEvent.ShortcutOverride, QtCore.QEvent.Shortcut,
+               QtCore.QEvent.Drop)
+
+    def __init__(self, window):
+        super(InputBlocker, self).__init__(window)
+        self.window = window
+
+    def eventFilter(self, obj, event):
+        if event.type() not in self.BLOCKED:
+            return False
+        return not (isinstance(obj, QtWidgets.QWidget) and
+                    obj.window() is self.window)
+
+
+class ScatterWorker(QtCore.QThread):
+    """Runs the scene-free part of a scatter off the main thread"""
+
+    failed = QtCore.Signal(str)
+
+    def __init__(self, scattering, parent=None):
+        super(ScatterWorker, self).__init__(parent)
+        self.scattering = scattering
+
+    def run(self):
+        try:
+            self.scattering.compute_transforms()
+        except Exception as err:
+            self.failed.emit(str(err))
+
+
 class ScatterUI(QtWidgets.QDialog):
     """Scatter UI Class"""
 
@@ -26,6 +121,13 @@ class ScatterUI(QtWidgets.QDialog):
                             QtCore.Qt.WindowContextHelpButtonHint)
 
         self.scattering = Scatter()
+        self.worker = ScatterWorker(self.scattering, parent=self)
+        self.apply_timer = QtCore.QTimer(self)
+        self.input_blocker = InputBlocker(self)
+        self._steps = None
+        self._compute_error = None
+        self._cancelled = False
+        self._running = False
         self.create_ui()
         self._create_connections()
 
@@ -39,6 +141,9 @@ class ScatterUI(QtWidgets.QDialog):
         self.r_layout = self._create_rotate_ui()
         self.btn_layout = self._create_button_ui()
         self.normals_layout = self._create_normals_ui()
+        self.sampling_layout = self._create_sampling_ui()
+        self.density_layout = self._create_density_ui()
+        self.camera_layout = self._create_camera_ui()
         self.m_layout = self._create_material_scatter_ui()
 
         self.rs_layout = QtWidgets.QHBoxLayout()
@@ -48,6 +153,9 @@ class ScatterUI(QtWidgets.QDialog):
         self.primary_layout = QtWidgets.QVBoxLayout()
         self.primary_layout.addWidget(self.heading)
         self.primary_layout.addLayout(self.object_layout)
+        self.primary_layout.addLayout(self.sampling_layout)
+        self.primary_layout.addLayout(self.density_layout)
+        self.primary_layout.addLayout(self.camera_layout)
         self.primary_layout.addLayout(self.normals_layout)
         self.primary_layout.addLayout(self.rs_headers)
         self.primary_layout.addLayout(self.rs_layout)
@@ -58,20 +166,32 @@ class ScatterUI(QtWidgets.QDialog):
         self.setLayout(self.primary_layout)
 
     def _create_object_ui(self):
-        default_obj1 = self.scattering.to_transfer_sel
+        default_obj1 = format_palette(self.scattering.source_palette)
         default_scatter_percent = self.scattering.scatter_percentage
 
         self.obj1_le = QtWidgets.QLineEdit(default_obj1)
+        self.obj1_le.setPlaceholderText("rock_a:3, rock_b  (default: first "
+                                        "transform in scene)")
         self.percent_dbspx = QtWidgets.QDoubleSpinBox(maximum=1.0,
                                                       singleStep=0.05)
         self.percent_dbspx.setValue(default_scatter_percent)
 
+        self.seed_spbx = QtWidgets.QSpinBox(maximum=2147483647)
+        self.seed_spbx.setValue(self.scattering.seed)
+
+        self.instancer_ckbx = QtWidgets.QCheckBox('Use Single Instancer Node')
+        self.instancer_ckbx.setChecked(
+            self.scattering.instance_mode == Scatter.INSTANCER_MODE)
+
         layout = QtWidgets.QGridLayout()
         layout.addWidget(QtWidgets.QLabel("Scatter"), 0, 0)
         layout.addWidget(self.obj1_le, 0, 1)
         layout.addWidget(QtWidgets.QLabel("on to"), 0, 2)
         layout.addWidget(self.percent_dbspx, 0, 3)
         layout.addWidget(QtWidgets.QLabel('Decimal % of Selection'), 0, 4)
+        layout.addWidget(self.instancer_ckbx, 1, 1)
+        layout.addWidget(QtWidgets.QLabel("Seed"), 1, 2)
+        layout.addWidget(self.seed_spbx, 1, 3)
 
         return layout
 
@@ -81,12 +201,126 @@ class ScatterUI(QtWidgets.QDialog):
         self.align_normals_ckbx = QtWidgets.QCheckBox('Align to Normals')
         self.align_normals_ckbx.setChecked(default_align_val)
 
+        self.bake_normals_ckbx = QtWidgets.QCheckBox(
+            'Bake Orientation (no constraints)')
+        self.bake_normals_ckbx.setChecked(
+            self.scattering.align_mode == Scatter.BAKED_ALIGN)
+
         header = QtWidgets.QLabel("Align to Vertex Normals")
         header.setStyleSheet("font: bold 20px")
 
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(header)
         layout.addWidget(self.align_normals_ckbx)
+        layout.addWidget(self.bake_normals_ckbx)
+
+        return layout
+
+    def _create_sampling_ui(self):
+        self.surface_ckbx = QtWidgets.QCheckBox('Sample Surface by Area')
+        self.surface_ckbx.setChecked(
+            self.scattering.sample_mode == Scatter.SURFACE_SAMPLING)
+
+        self.sample_count_spbx = QtWidgets.QSpinBox(maximum=10000000)
+        self.sample_count_spbx.setValue(self.scattering.sample_count)
+
+        self.min_distance_dbspx = QtWidgets.QDoubleSpinBox(maximum=10000.0,
+                                                           singleStep=0.1)
+        self.min_distance_dbspx.setValue(self.scattering.min_distance)
+
+        self.workers_spbx = QtWidgets.QSpinBox(minimum=1, maximum=256)
+        self.workers_spbx.setValue(self.scattering.workers)
+        if scatter_shards.process_context() is None:
+            self.workers_spbx.setValue(1)
+            self.workers_spbx.setEnabled(False)
+            self.workers_spbx.setToolTip(
+                "Worker processes need Python 3 or Windows inside the "
+                "Maya GUI; run scatter_batch.py with mayapy instead.")
+
+        header = QtWidgets.QLabel("Surface Sampling")
+        header.setStyleSheet("font: bold 20px")
+
+        sublayout = QtWidgets.QHBoxLayout()
+        sublayout.addWidget(self.surface_ckbx)
+        sublayout.addWidget(QtWidgets.QLabel("Points"))
+        sublayout.addWidget(self.sample_count_spbx)
+        sublayout.addWidget(QtWidgets.QLabel("Min Distance"))
+        sublayout.addWidget(self.min_distance_dbspx)
+        sublayout.addWidget(QtWidgets.QLabel("Worker Processes"))
+        sublayout.addWidget(self.workers_spbx)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(header)
+        layout.addLayout(sublayout)
+
+        return layout
+
+    def _create_density_ui(self):
+        self.density_cmbx = QtWidgets.QComboBox()
+        self.density_cmbx.addItem("None", None)
+        self.density_cmbx.addItem("Color Set", scatter_density.COLOR_SET)
+        self.density_cmbx.addItem("Weight Map", scatter_density.WEIGHTS)
+        self.density_cmbx.addItem("Texture", scatter_density.TEXTURE)
+
+        self.density_le = QtWidgets.QLineEdit()
+        self.density_le.setPlaceholderText("color set, attribute or texture")
+        self.density_channel_cmbx = QtWidgets.QComboBox()
+        self.density_channel_cmbx.addItems(
+            [scatter_density.LUMINANCE] + sorted(scatter_density.CHANNELS))
+
+        density_map = self.scattering.density_map
+        if density_map is not None:
+            self.density_cmbx.setCurrentIndex(
+                self.density_cmbx.findData(density_map.kind))
+            self.density_le.setText(density_map.name)
+            self.density_channel_cmbx.setCurrentText(density_map.channel)
+
+        header = QtWidgets.QLabel("Density Map")
+        header.setStyleSheet("font: bold 20px")
+
+        sublayout = QtWidgets.QHBoxLayout()
+        sublayout.addWidget(self.density_cmbx)
+        sublayout.addWidget(self.density_le)
+        sublayout.addWidget(self.density_channel_cmbx)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(header)
+        layout.addLayout(sublayout)
+
+        return layout
+
+    def _create_camera_ui(self):
+        self.camera_le = QtWidgets.QLineEdit(self.scattering.camera or '')
+        self.camera_le.setPlaceholderText("no culling")
+
+        self.start_frame_dbspx = QtWidgets.QDoubleSpinBox(
+            minimum=-100000.0, maximum=100000.0)
+        self.start_frame_dbspx.setValue(self.scattering.frame_range[0])
+        self.end_frame_dbspx = QtWidgets.QDoubleSpinBox(
+            minimum=-100000.0, maximum=100000.0)
+        self.end_frame_dbspx.setValue(self.scattering.frame_range[1])
+        self.cull_margin_dbspx = QtWidgets.QDoubleSpinBox(maximum=10000.0)
+        self.cull_margin_dbspx.setValue(self.scattering.cull_margin)
+
+        self.lod_le = QtWidgets.QLineEdit(
+            format_palette(self.scattering.lod_proxies))
+        self.lod_le.setPlaceholderText("rock_mid:50, rock_low:200")
+
+        header = QtWidgets.QLabel("Camera Culling and LOD")
+        header.setStyleSheet("font: bold 20px")
+
+        layout = QtWidgets.QGridLayout()
+        layout.addWidget(header, 0, 0, 1, 4)
+        layout.addWidget(QtWidgets.QLabel("Camera"), 1, 0)
+        layout.addWidget(self.camera_le, 1, 1)
+        layout.addWidget(QtWidgets.QLabel("Margin"), 1, 2)
+        layout.addWidget(self.cull_margin_dbspx, 1, 3)
+        layout.addWidget(QtWidgets.QLabel("Frames"), 2, 0)
+        layout.addWidget(self.start_frame_dbspx, 2, 1)
+        layout.addWidget(QtWidgets.QLabel("to"), 2, 2)
+        layout.addWidget(self.end_frame_dbspx, 2, 3)
+        layout.addWidget(QtWidgets.QLabel("Proxies beyond"), 3, 0)
+        layout.addWidget(self.lod_le, 3, 1, 1, 3)
 
         return layout
 
@@ -185,13 +419,15 @@ class ScatterUI(QtWidgets.QDialog):
 
     def _create_material_scatter_ui(self):
         default_scatter_material = self.scattering.materials
-        default_material = self.scattering.scatter_material
+        default_material = format_palette(self.scattering.material_palette)
         default_material_percent = self.scattering.materials_percentage
 
         self.materials_ckbx = QtWidgets.QCheckBox('Scatter Materials')
         self.materials_ckbx.setChecked(default_scatter_material)
 
         self.material_le = QtWidgets.QLineEdit(default_material)
+        self.material_le.setToolTip("Comma separated materials with optional "
+                                    "weights, e.g. rock_mat:3, moss_mat:1")
 
         self.material_dbsx = QtWidgets.QDoubleSpinBox(maximum=1.0,
                                                       singleStep=0.05)
@@ -219,24 +455,157 @@ class ScatterUI(QtWidgets.QDialog):
         return layout
 
     def _create_button_ui(self):
+        self.update_ckbx = QtWidgets.QCheckBox('Update Previous Scatter')
+        self.update_ckbx.setChecked(self.scattering.update_previous)
         self.scatter_btn = QtWidgets.QPushButton("Scatter")
+        self.cancel_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.export_btn = QtWidgets.QPushButton("Export Points...")
+        self.import_btn = QtWidgets.QPushButton("Import Points...")
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setValue(0)
+        self.status_lbl = QtWidgets.QLabel("")
+
+        btn_layout = QtWidgets.QHBoxLayout()
+        btn_layout.addWidget(self.update_ckbx)
+        btn_layout.addWidget(self.scatter_btn)
+        btn_layout.addWidget(self.cancel_btn)
+        btn_layout.addWidget(self.export_btn)
+        btn_layout.addWidget(self.import_btn)
 
-        layout = QtWidgets.QHBoxLayout()
-        layout.addWidget(self.scatter_btn)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_lbl)
+        layout.addLayout(btn_layout)
 
         return layout
 
     def _create_connections(self):
         self.scatter_btn.clicked.connect(self._scatter_the_things)
+        self.cancel_btn.clicked.connect(self._cancel_scatter)
+        self.export_btn.clicked.connect(self._export_points)
+        self.import_btn.clicked.connect(self._import_points)
+        self.worker.failed.connect(self._compute_failed)
+        self.worker.finished.connect(self._start_applying)
+        self.apply_timer.timeout.connect(self._apply_next_chunk)
 
     @QtCore.Slot()
     def _scatter_the_things(self):
         """create instances on the vertices"""
         self._scatter_properties_from_ui()
-        self.scattering.creating_instances()
+        try:
+            self.scattering.gather_geometry()
+        except ValueError as err:
+            self.status_lbl.setText(str(err))
+            return
+
+        self._compute_error = None
+        self._cancelled = False
+        self._set_running(True)
+        self.progress_bar.setRange(0, 0)
+        self.status_lbl.setText("Computing points...")
+        self.worker.start()
+
+    @QtCore.Slot(str)
+    def _compute_failed(self, message):
+        self._compute_error = message
+
+    @QtCore.Slot()
+    def _start_applying(self):
+        """Start committing the computed points once the worker is done"""
+        if self._cancelled or self._compute_error:
+            self._set_running(False)
+            self.status_lbl.setText(self._compute_error or "Cancelled")
+            return
+
+        self._steps = self.scattering.scatter_steps()
+        self._apply_start = time.time()
+        self.progress_bar.setRange(0, max(len(self.scattering.transforms), 1))
+        self.status_lbl.setText("Creating instances...")
+        QtWidgets.QApplication.instance().installEventFilter(
+            self.input_blocker)
+        self.apply_timer.start(0)
+
+    @QtCore.Slot()
+    def _apply_next_chunk(self):
+        """Apply one chunk of scene edits and report progress"""
+        try:
+            done, total = next(self._steps)
+        except StopIteration:
+            self._finish_applying("Scattered {} points".format(
+                len(self.scattering.transforms)))
+            return
+        except Exception as err:
+            self._finish_applying(str(err))
+            raise
+
+        elapsed = time.time() - self._apply_start
+        eta = elapsed / done * (total - done) if done else 0.0
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.status_lbl.setText("{} / {} points, about {:.0f}s left".format(
+            done, total, eta))
+
+    @QtCore.Slot()
+    def _cancel_scatter(self):
+        """Stop the running scatter and remove what it already created"""
+        self._cancelled = True
+        if self.apply_timer.isActive():
+            self._steps.close()
+            self._finish_applying("Cancelled")
+        else:
+            self.status_lbl.setText("Cancelling...")
+
+    @QtCore.Slot()
+    def _export_points(self):
+        """Save the last computed points to a point cloud file"""
+        if self.scattering.last_scatter is None:
+            self.status_lbl.setText("Scatter something to export first")
+            return
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export Points", filter="Scatter points (*.scpc)")
+        if path:
+            self.scattering.export_points(path)
+            self.status_lbl.setText("Exported {} points".format(
+                len(self.scattering.transforms)))
+
+    @QtCore.Slot()
+    def _import_points(self):
+        """Instance the points stored in a point cloud file"""
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Import Points", filter="Scatter points (*.scpc)")
+        if path:
+            self._scatter_properties_from_ui()
+            self.scattering.import_points(path)
+            self.status_lbl.setText("Imported {} points".format(
+                len(self.scattering.transforms)))
+
+    def _finish_applying(self, message):
+        self.apply_timer.stop()
+        QtWidgets.QApplication.instance().removeEventFilter(
+            self.input_blocker)
+        self._steps = None
+        self._set_running(False)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0 if self._cancelled else 1)
+        self.status_lbl.setText(message)
+
+    def closeEvent(self, event):
+        """Cancel a running scatter, which also gives Maya its input back"""
+        if self._running:
+            self._cancel_scatter()
+        super(ScatterUI, self).closeEvent(event)
+
+    def _set_running(self, running):
+        self._running = running
+        self.scatter_btn.setEnabled(not running)
+        self.cancel_btn.setEnabled(running)
+        self.export_btn.setEnabled(not running)
+        self.import_btn.setEnabled(not running)
 
     def _scatter_properties_from_ui(self):
-        self.scattering.to_transfer_sel = self.obj1_le.text()
+        self.scattering.source_palette = parse_palette(self.obj1_le.text())
 
         self.scattering.min_sx = self.sx_min.value()
         self.scattering.max_sx = self.sx_max.value()
@@ -253,26 +622,62 @@ class ScatterUI(QtWidgets.QDialog):
         self.scattering.max_rz = self.rz_max.value()
 
         self.scattering.scatter_percentage = self.percent_dbspx.value()
+        self.scattering.seed = self.seed_spbx.value()
+        if self.surface_ckbx.isChecked():
+            self.scattering.sample_mode = Scatter.SURFACE_SAMPLING
+        else:
+            self.scattering.sample_mode = Scatter.VERTEX_SAMPLING
+        self.scattering.sample_count = self.sample_count_spbx.value()
+        self.scattering.min_distance = self.min_distance_dbspx.value()
+        self.scattering.workers = self.workers_spbx.value()
+        density_kind = self.density_cmbx.currentData()
+        if density_kind and self.density_le.text():
+            self.scattering.density_map = scatter_density.DensityMap(
+                density_kind, self.density_le.text(),
+                self.density_channel_cmbx.currentText())
+        else:
+            self.scattering.density_map = None
+        self.scattering.camera = self.camera_le.text() or None
+        self.scattering.frame_range = (self.start_frame_dbspx.value(),
+                                       self.end_frame_dbspx.value())
+        self.scattering.cull_margin = self.cull_margin_dbspx.value()
+        self.scattering.lod_proxies = parse_palette(self.lod_le.text())
         self.scattering.collect_normals = self.align_normals_ckbx.checkState()
+        if self.bake_normals_ckbx.isChecked():
+            self.scattering.align_mode = Scatter.BAKED_ALIGN
+        else:
+            self.scattering.align_mode = Scatter.CONSTRAINT_ALIGN
+        if self.instancer_ckbx.isChecked():
+            self.scattering.instance_mode = Scatter.INSTANCER_MODE
+        else:
+            self.scattering.instance_mode = Scatter.NODES_MODE
 
         self.scattering.materials = self.materials_ckbx.checkState()
-        self.scattering.scatter_material = self.material_le.text()
+        self.scattering.material_palette = parse_palette(
+            self.material_le.text())
         self.scattering.materials_percentage = self.material_dbsx.value()
+        self.scattering.update_previous = self.update_ckbx.isChecked()
 
 
 class Scatter(object):
     """My code for the Scatter Tool"""
 
-    def __init__(self):
-        self.cur_sel = cmds.ls(selection=True, flatten=True)
-        self.all_trans = cmds.ls(transforms=True)
+    CHUNK_SIZE = 500
+
+    NODES_MODE = 'nodes'
+    INSTANCER_MODE = 'instancer'
+    CONSTRAINT_ALIGN = 'constraint'
+    BAKED_ALIGN = 'baked'
+    VERTEX_SAMPLING = 'vertices'
+    SURFACE_SAMPLING = 'surface'
 
-        self.to_transfer_sel = self.all_trans[0]
+    def __init__(self):
+        self._cur_sel = None
+        self._transfer_vert = None
+        self.created_nodes = []
+        self.moved_rows = []
 
-        self.transfer_sel = cmds.polyListComponentConversion(self.cur_sel,
-                                                             toVertex=True)
-        self.transfer_vert = cmds.filterExpand(self.transfer_sel,
-                                               selectionMask=31)
+        self.source_palette = []
 
         self.min_sx = 1.0
         self.max_sx = 1.0
@@ -289,78 +694,526 @@ class Scatter(object):
         self.max_rz = 0.0
 
         self.scatter_percentage = 1.0
+        self.seed = 0
+        self.sample_mode = self.VERTEX_SAMPLING
+        self.sample_count = 1000
+        self.min_distance = 0.0
+        self.instance_mode = self.NODES_MODE
+        self.density_map = None
+
+        self.camera = None
+        self.frame_range = (1.0, 1.0)
+        self.frame_step = 1.0
+        self.cull_margin = 0.0
+        self.lod_proxies = []
+        self.workers = 1
 
         self.collect_normals = False
+        self.align_mode = self.CONSTRAINT_ALIGN
 
         self.materials = False
         self.materials_percentage = 1.0
-        self.scatter_material = 'lambert1'
+        self.material_palette = [('lambert1', 1.0)]
+
+        self.update_previous = True
+        self.last_scatter = None
+        self.assigned_materials = {}
+        self.geometry_cache = scatter_cache.GEOMETRY_CACHE
+        self.profiler = profiling.Profiler('scatter')
+
+    @property
+    def cur_sel(self):
+        if self._cur_sel is None:
+            self._cur_sel = cmds.ls(selection=True)
+        return self._cur_sel
+
+    @property
+    def transfer_vert(self):
+        if self._transfer_vert is None:
+            self._transfer_vert = \
+                scatter_engine.MeshComponents.from_selection(self.cur_sel,
+                                                             'vtx')
+        return self._transfer_vert
+
+    def refresh_selection(self):
+        """Forget the cached selection so it is read again when needed"""
+        self._cur_sel = None
+        self._transfer_vert = None
+
+    def sources(self):
+        """Return the objects to scatter, defaulting to the first transform"""
+        if self.source_palette:
+            return [name for name, _ in self.source_palette]
+        first_trans = cmds.ls(transforms=True, head=1)
+        return first_trans[:1] or [None]
 
     def creating_instances(self):
-
-        self.scattered_group = []
-        self.scatter_randomizer()
-
-        for vertex in self.percentage_selection:
-            new_geo = cmds.instance(self.to_transfer_sel)
-            vtx_pos = cmds.xform([vertex], query=True, translation=True)
-            cmds.xform(new_geo, translation=vtx_pos,
-                       scale=self.randomize_scale(),
-                       rotation=self.randomize_rotation(),
-                       worldSpace=True)
-            self.scattered_group.extend(new_geo)
-
-            if self.collect_normals:
-                cmds.normalConstraint(vertex, new_geo)
-
-        self.scatter_materials()
+        """Scatter instances, updating the previous scatter if possible"""
+        self.gather_geometry()
+        self.compute_transforms()
+        for _ in self.scatter_steps():
+            pass
+
+        return self.last_scatter['group']
+
+    def gather_geometry(self):
+        """Read the selection and target geometry from the scene.
+
+        This has to run on the main thread. compute_transforms only uses
+        what is stored here, so it is safe to run on a worker thread.
+        """
+        with self.profiler.stage('selection') as stage:
+            self.refresh_selection()
+            variants = self.sources()
+            self.source_obj = variants[0]
+            self.source_objs = variants + [
+                proxy for proxy, _ in self.lod_bands()]
+            if self.sample_mode == self.SURFACE_SAMPLING:
+                targets = scatter_engine.MeshComponents.from_selection(
+                    self.cur_sel, 'f')
+            else:
+                targets = self.transfer_vert
+            stage['items'] = len(targets)
+
+        self.geometry = {'points': np.zeros((0, 3))}
+        with self.profiler.stage('geometry'):
+            if self.camera:
+                self.geometry['views'] = scatter_camera.camera_views(
+                    self.camera, self.frame_range[0], self.frame_range[1],
+                    self.frame_step)
+            if self.density_map is not None and len(targets):
+                density_key = self.density_map.cache_key()
+                if density_key is None:
+                    self.geometry['density'] = self.density_map.load(
+                        targets.mesh)
+                else:
+                    self.geometry['density'] = self.geometry_cache.get(
+                        targets.mesh, density_key, self.density_map.load)
+            if self.sample_mode == self.SURFACE_SAMPLING:
+                self.gather_surface(targets)
+            elif len(targets):
+                self.geometry['points'] = self.geometry_cache.get(
+                    targets.mesh, 'points', scatter_engine.fetch_points)
+                if self.collect_normals and self.bakes_normals():
+                    self.geometry['normals'] = self.geometry_cache.get(
+                        targets.mesh, 'normals', scatter_engine.fetch_normals)
+
+        self.layout = self.layout_key()
+        return self.geometry
+
+    def gather_surface(self, faces):
+        """Store the cached triangles of the selected faces.
+
+        A density map scales each triangle's area by the mean density of
+        its corners, so samples land proportionally to painted density.
+        """
+        self.geometry['triangles'] = np.zeros((0, 3), dtype=np.int64)
+        if len(faces):
+            points, triangles, tri_faces, areas = self.geometry_cache.get(
+                faces.mesh, 'surface', load_surface)
+            rows = scatter_sampling.select_triangles(
+                triangles, tri_faces, faces.indices)
+            areas = areas[rows]
+            if 'density' in self.geometry:
+                areas = areas * self.geometry['density'][
+                    triangles[rows]].mean(axis=1)
+            self.geometry.update(points=points, triangles=triangles[rows],
+                                 areas=areas)
+
+    def compute_transforms(self):
+        """Return the TransformBuffer for the gathered geometry.
+
+        With more than one worker, large targets are split into shards
+        computed on a process pool. The result is identical either way.
+        """
+        settings = self.point_settings()
+        geometry = dict(self.geometry)
+        if self.sample_mode == self.VERTEX_SAMPLING:
+            geometry['vertex_ids'] = self.transfer_vert.indices
+
+        count = scatter_shards.candidate_count(settings, geometry)
+        if (self.workers > 1 and
+                count >= scatter_shards.MIN_SHARD_POINTS * self.workers):
+            transforms = scatter_shards.compute_points_parallel(
+                settings, geometry, self.workers, self.profiler)
+        else:
+            transforms = scatter_shards.compute_points(settings, geometry,
+                                                       self.profiler)
+        self.transforms = transforms
+        return transforms
+
+    def point_settings(self):
+        """Return the PointSettings point generation needs"""
+        scale_range, rotation_range = self.random_ranges()
+        material_weights = None
+        if self.materials and self.material_palette:
+            material_weights = [weight for _, weight in self.material_palette]
+        source_weights = None
+        if len(self.source_palette) > 1:
+            source_weights = [weight for _, weight in self.source_palette]
+        return scatter_shards.PointSettings(
+            self.seed,
+            surface=self.sample_mode == self.SURFACE_SAMPLING,
+            sample_count=self.sample_count,
+            min_distance=self.min_distance,
+            scatter_percentage=self.scatter_percentage,
+            scale_range=scale_range, rotation_range=rotation_range,
+            align_normals=bool(self.collect_normals and self.bakes_normals()),
+            material_weights=material_weights,
+            materials_percentage=self.materials_percentage,
+            source_weights=source_weights,
+            lod_distances=[distance for _, distance in self.lod_bands()],
+            variant_count=max(len(self.source_palette), 1),
+            cull_margin=self.cull_margin)
+
+    def export_points(self, path):
+        """Write the computed transforms to a binary point cloud file"""
+        cloud = scatter_pointcloud.PointCloud(
+            self.transforms,
+            [name for name, _ in self.material_palette],
+            self.source_objs)
+        scatter_pointcloud.write_points(path, cloud)
+
+    def import_points(self, path):
+        """Instance the points of a point cloud file without recomputing.
+
+        The source object defaults to the one stored in the file. Rotations
+        are applied as stored, so normal constraints are not recreated.
+        """
+        cloud = scatter_pointcloud.read_points(path)
+        self.refresh_selection()
+        self.source_objs = cloud.sources or self.sources()
+        for idx, (name, _) in enumerate(self.source_palette):
+            if idx < len(self.source_objs):
+                self.source_objs[idx] = name
+        self.source_obj = self.source_objs[0]
+        self.transforms = cloud.transforms
+        self.material_palette = [(name, 1.0) for name in cloud.materials]
+        self.materials = bool(np.any(self.transforms.material_ids >= 0))
+        self.collect_normals = False
+        self.layout = ['points', path, self.source_objs, self.instance_mode]
+
+        for _ in self.scatter_steps():
+            pass
+        return self.last_scatter['group']
+
+    def scatter_steps(self, chunk_size=None):
+        """Apply the computed transforms to the scene chunk by chunk.
+
+        Yields (done, total) after each chunk. The whole run is a single
+        undo step with the viewport refresh suspended. Nothing is deleted
+        before the last chunk, so a run that is closed early or fails is
+        rolled back inside that undo step and leaves nothing to undo.
+        """
+        with suspended_scene_updates('scatter'):
+            try:
+                for step in self._apply_chunks(chunk_size):
+                    yield step
+            except BaseException:
+                # GeneratorExit from close() lands here too
+                self.rollback()
+                raise
+
+    def _apply_chunks(self, chunk_size):
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        self.created_nodes = []
+        self.moved_rows = []
+        updating = (self.update_previous and self.last_scatter and
+                    self.can_update())
+        if updating:
+            nodes = self.last_scatter['nodes']
+            moved, added, removed = self.scatter_delta()
+        else:
+            nodes = {}
+            moved = removed = np.zeros(0, dtype=np.int64)
+            added = np.arange(len(self.transforms))
+
+        if self.instance_mode == self.INSTANCER_MODE:
+            with self.profiler.stage('instancing') as stage:
+                self.created_nodes.extend(self.instance_with_particles())
+                stage['items'] = len(self.transforms)
+            yield 1, 1
+        else:
+            done = 0
+            total = len(moved) + len(added)
+            point_ids = self.transforms.point_ids
+            for chunk in range(0, len(moved), chunk_size):
+                rows = moved[chunk:chunk + chunk_size].tolist()
+                with self.profiler.stage('instancing') as stage:
+                    for idx in rows:
+                        self.place_instance(nodes[int(point_ids[idx])],
+                                            self.transforms, idx)
+                    stage['items'] = len(rows)
+                self.moved_rows.extend(rows)
+                done += len(rows)
+                yield done, total
+            for chunk in range(0, len(added), chunk_size):
+                rows = added[chunk:chunk + chunk_size]
+                with self.profiler.stage('instancing') as stage:
+                    self.created_nodes.extend(self.instance_with_nodes(rows))
+                    stage['items'] = len(rows)
+                done += len(rows)
+                yield done, total
+
+        if updating:
+            self.finish_update(added, removed)
+        else:
+            self.finish_scatter()
+
+    def finish_scatter(self):
+        """Group a freshly built scatter and replace the previous one"""
+        self.scattered_group = list(self.created_nodes)
+        self.assigned_materials = {}
+        if self.instance_mode == self.NODES_MODE:
+            self.scatter_materials()
 
         instance_group = cmds.group(self.scattered_group, name='scatter_group')
-
-        return instance_group
-
-    def randomize_scale(self):
-        random_sx = random.uniform(self.min_sx, self.max_sx)
-        random_sy = random.uniform(self.min_sy, self.max_sy)
-        random_sz = random.uniform(self.min_sz, self.max_sz)
-
-        rand_scale = [random_sx, random_sy, random_sz]
-        return rand_scale
-
-    def randomize_rotation(self):
-        random_rx = random.uniform(self.min_rx, self.max_rx)
-        random_ry = random.uniform(self.min_ry, self.max_ry)
-        random_rz = random.uniform(self.min_rz, self.max_rz)
-
-        rand_rotate = (random_rx, random_ry, random_rz)
-        return rand_rotate
+        if self.update_previous and self.last_scatter and \
+                cmds.objExists(self.last_scatter['group']):
+            cmds.delete(self.last_scatter['group'])
+        self.remember_scatter(instance_group)
+
+    def finish_update(self, added, removed):
+        """Fold added points into the previous group and drop removed ones"""
+        group = self.last_scatter['group']
+        nodes = self.last_scatter['nodes']
+        if len(removed):
+            cmds.delete([nodes.pop(pid) for pid in removed.tolist()])
+        if self.created_nodes:
+            new_geo = cmds.parent(self.created_nodes, group)
+            nodes.update(zip(self.transforms.point_ids[added].tolist(),
+                             new_geo))
+
+        self.scattered_group = [nodes[pid] for pid in
+                                self.transforms.point_ids.tolist()]
+        self.scatter_materials()
+        self.last_scatter['transforms'] = self.transforms
+
+    def rollback(self):
+        """Undo the chunks applied by an unfinished scatter_steps run"""
+        if self.created_nodes:
+            cmds.delete(self.created_nodes)
+        if self.moved_rows:
+            old = self.last_scatter['transforms']
+            nodes = self.last_scatter['nodes']
+            point_ids = self.transforms.point_ids[self.moved_rows]
+            old_rows = np.searchsorted(old.point_ids, point_ids)
+            for pid, row in zip(point_ids.tolist(), old_rows.tolist()):
+                self.place_instance(nodes[pid], old, row)
+        self.created_nodes = []
+        self.moved_rows = []
+
+    def layout_key(self):
+        """Return the settings that force a full re-scatter when changed"""
+        key = [self.source_objs, self.instance_mode, self.sample_mode,
+               self.seed, self.collect_normals, self.align_mode]
+        if self.sample_mode == self.SURFACE_SAMPLING:
+            key.extend([self.min_distance,
+                        self.sample_count if self.min_distance else None])
+        else:
+            key.append(self.transfer_vert.mesh)
+        return key
+
+    def remember_scatter(self, instance_group):
+        """Store what was built so the next scatter can update it"""
+        nodes = {}
+        if self.instance_mode == self.NODES_MODE:
+            nodes = dict(zip(self.transforms.point_ids.tolist(),
+                             self.scattered_group))
+        self.last_scatter = {'group': instance_group,
+                             'layout': self.layout,
+                             'transforms': self.transforms,
+                             'nodes': nodes}
+
+    def can_update(self):
+        """Return whether the last scatter can be updated in place.
+
+        An undo or a manual edit may have deleted tracked instances or
+        brought back untracked ones, and then the group is rebuilt.
+        """
+        group = self.last_scatter['group']
+        if (self.instance_mode != self.NODES_MODE or
+                self.last_scatter['layout'] != self.layout or
+                not cmds.objExists(group)):
+            return False
+        nodes = list(self.last_scatter['nodes'].values())
+        children = cmds.listRelatives(group, children=True) or []
+        return (len(children) == len(nodes) and
+                len(cmds.ls(nodes)) == len(nodes))
+
+    def scatter_delta(self):
+        """Return rows to move, rows to add and point ids to remove.
+
+        Points whose source changed, e.g. into another LOD band, are
+        removed and added again.
+        """
+        old = self.last_scatter['transforms']
+        new = self.transforms
+
+        removed = old.point_ids[~np.isin(old.point_ids, new.point_ids)]
+        added = np.flatnonzero(~np.isin(new.point_ids, old.point_ids))
+
+        kept = np.flatnonzero(np.isin(new.point_ids, old.point_ids))
+        old_rows = np.searchsorted(old.point_ids, new.point_ids[kept])
+        swapped = (new.source_id_array()[kept] !=
+                   old.source_id_array()[old_rows])
+        changed = np.zeros(len(kept), dtype=bool)
+        for name in ('positions', 'rotations', 'scales'):
+            delta = getattr(new, name)[kept] - getattr(old, name)[old_rows]
+            changed |= np.any(np.abs(delta) > 1e-9, axis=1)
+
+        if swapped.any():
+            added = np.sort(np.concatenate((added, kept[swapped])))
+            removed = np.concatenate((removed,
+                                      new.point_ids[kept[swapped]]))
+        return kept[changed & ~swapped], added, removed
+
+    def place_instance(self, node, transforms, idx):
+        """Move, rotate and scale one instance to row idx of transforms"""
+        vtx_pos, rotation, scale = transforms.transform(idx)
+        cmds.xform(node, translation=vtx_pos,
+                   scale=scale,
+                   rotation=rotation,
+                   worldSpace=True)
+
+    def instance_with_nodes(self, rows=None):
+        """Create one instanced transform per point and return them"""
+        if rows is None:
+            rows = range(len(self.transforms))
+        source_ids = self.transforms.source_id_array()
+        instances = []
+        for idx in rows:
+            new_geo = cmds.instance(self.source_objs[source_ids[idx]])
+            self.place_instance(new_geo, self.transforms, idx)
+            instances.extend(new_geo)
+
+            if self.collect_normals and not self.bakes_normals():
+                vertex = self.transfer_vert.names(
+                    [self.transforms.point_ids[idx]])
+                cmds.normalConstraint(vertex, new_geo)
+        return instances
+
+    def instance_with_particles(self):
+        """Drive a single particle instancer from the transform buffer.
+
+        Instances share the source's shading, so materials are not scattered
+        in this mode.
+        """
+        positions = self.transforms.positions.tolist()
+        particle_tr, particle_shape = cmds.particle(position=positions,
+                                                    name='scatter_points')
+        cmds.setAttr(particle_shape + '.isDynamic', False)
+
+        per_point = (('rotationPP', self.transforms.rotations),
+                     ('scalePP', self.transforms.scales))
+        for attr_name, values in per_point:
+            values = [tuple(value) for value in values.tolist()]
+            for name in (attr_name, attr_name + '0'):
+                cmds.addAttr(particle_shape, longName=name,
+                             dataType='vectorArray')
+                cmds.setAttr(particle_shape + '.' + name, len(values),
+                             *values, type='vectorArray')
+
+        index_flags = {}
+        if len(self.source_objs) > 1:
+            source_ids = self.transforms.source_id_array().tolist()
+            for name in ('objectIndexPP', 'objectIndexPP0'):
+                cmds.addAttr(particle_shape, longName=name,
+                             dataType='doubleArray')
+                cmds.setAttr(particle_shape + '.' + name, source_ids,
+                             type='doubleArray')
+            index_flags['objectIndex'] = 'objectIndexPP'
+        cmds.saveInitialState(particle_shape)
+
+        instancer = cmds.particleInstancer(particle_shape, addObject=True,
+                                           object=self.source_objs,
+                                           position='worldPosition',
+                                           rotation='rotationPP',
+                                           scale='scalePP', **index_flags)
+        return [particle_tr, instancer]
+
+    def lod_bands(self):
+        """Return the (proxy, distance) LOD bands, nearest first"""
+        return sorted(self.lod_proxies, key=lambda band: band[1])
+
+    def random_ranges(self):
+        """Return the (mins, maxs) scale and rotation ranges"""
+        scale_range = ((self.min_sx, self.min_sy, self.min_sz),
+                       (self.max_sx, self.max_sy, self.max_sz))
+        rotation_range = ((self.min_rx, self.min_ry, self.min_rz),
+                          (self.max_rx, self.max_ry, self.max_rz))
+        return scale_range, rotation_range
+
+    def bakes_normals(self):
+        """Return whether normal alignment is baked into the rotations"""
+        return (self.align_mode == self.BAKED_ALIGN or
+                self.instance_mode == self.INSTANCER_MODE or
+                self.sample_mode == self.SURFACE_SAMPLING)
 
     def scatter_randomizer(self):
-        self.percentage_selection = []
-
-        for idx in range(0, len(self.transfer_vert)):
-            random.seed(idx)
-            rand_value = random.random()
-            if rand_value <= self.scatter_percentage:
-                self.percentage_selection.append(self.transfer_vert[idx])
+        density = None
+        if self.density_map is not None:
+            density = self.geometry['density']
+        self.percentage_selection = scatter_shards.select_vertices(
+            self.point_settings(), self.transfer_vert.indices, density)
 
         return self.percentage_selection
 
     def scatter_material_randomizer(self):
-        self.random_obj_coloring = []
-
-        for idx in range(0, len(self.scattered_group)):
-            random.seed(idx)
-            rand_value = random.random()
-            if rand_value <= self.materials_percentage:
-                self.random_obj_coloring.append(self.scattered_group[idx])
+        ids = self.transforms.material_ids
+        if ids is None:
+            ids = scatter_shards.material_ids(self.point_settings(),
+                                              self.transforms.point_ids)
+        keep = np.flatnonzero(ids >= 0)
+
+        shading_groups = [shading_group_of(name)
+                          for name, _ in self.material_palette]
+        self.random_obj_coloring = [self.scattered_group[idx]
+                                    for idx in keep.tolist()]
+        self.random_obj_materials = [shading_groups[pick]
+                                     for pick in ids[keep].tolist()]
 
         return self.random_obj_coloring
 
     def scatter_materials(self):
-        if self.materials:
-            self.scatter_material_randomizer()
+        """Assign materials with one sets call per shading group.
 
-            for geo in self.random_obj_coloring:
-                cmds.sets(geo, e=True,
-                          forceElement=self.scatter_material + 'SG')
+        Only instances whose material changed since the last scatter are
+        touched.
+        """
+        with self.profiler.stage('materials') as stage:
+            stage['items'] = self._assign_materials()
+
+    def _assign_materials(self):
+        wanted = {}
+        if self.materials and self.material_palette:
+            self.scatter_material_randomizer()
+            wanted = dict(zip(self.random_obj_coloring,
+                              self.random_obj_materials))
+
+        previous = self.assigned_materials
+        current = set(self.scattered_group)
+        batches = {}
+        for geo in set(wanted) | set(previous):
+            if geo in current and wanted.get(geo) != previous.get(geo):
+                batches.setdefault(wanted.get(geo), []).append(geo)
+
+        if None in batches:
+            source_ids = dict(zip(self.scattered_group,
+                                  self.transforms.source_id_array().tolist()))
+            fallbacks = {}
+            for geo in batches.pop(None):
+                source = self.source_objs[source_ids[geo]]
+                if source not in fallbacks:
+                    fallbacks[source] = self.source_shading_group(source)
+                batches.setdefault(fallbacks[source], []).append(geo)
+        for shading_group, geos in batches.items():
+            cmds.sets(geos, e=True, forceElement=shading_group)
+        self.assigned_materials = wanted
+        return sum(len(geos) for geos in batches.values())
+
+    def source_shading_group(self, source):
+        """Return the shading group instances of source fall back to"""
+        shapes = cmds.listRelatives(source, shapes=True) or []
+        groups = cmds.listConnections(shapes, type='shadingEngine') or []
+        return groups[0] if groups else 'initialShadingGroup'
@@ -0,0 +1,255 @@
+"""Run a scatter recipe over many scene files with mayapy.
+
+    mayapy scatter_batch.py recipe.json shot010.ma shot020.ma --workers 8
+
+Each scene runs in a fresh mayapy process, at most --workers at a time. A
+process that crashes, or is killed after --timeout seconds, still gets a
+report with status 'crashed' or 'timeout'.
+
+The recipe is a JSON (or YAML, when PyYAML is available) mapping such as
+
+    {"source": "rock_a:3, rock_b:1", "target": "terrain", "percentage": 0.2,
+     "seed": 7, "scale_min": [0.8, 0.8, 0.8], "scale_max": [1.2, 1.2, 1.2],
+     "rotation_min": [0, 0, 0], "rotation_max": [0, 360, 0],
+     "align_normals": true, "materials": "rock_mat:3, moss_mat:1",
+     "materials_percentage": 0.5, "save_task": "scatter",
+     "density": {"kind": "colorSet", "name": "density", "channel": "r"},
+     "camera": "shotCam", "frame_range": [1001, 1100],
+     "lod": "rock_mid:50, rock_low:200"}
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+POLL_SECONDS = 0.5
+
+RECIPE_ATTRS = {'percentage': 'scatter_percentage',
+                'seed': 'seed',
+                'align_normals': 'collect_normals',
+                'align_mode': 'align_mode',
+                'instance_mode': 'instance_mode',
+                'sample_mode': 'sample_mode',
+                'sample_count': 'sample_count',
+                'min_distance': 'min_distance',
+                'materials_percentage': 'materials_percentage',
+                'camera': 'camera',
+                'frame_step': 'frame_step',
+                'cull_margin': 'cull_margin'}
+RECIPE_AXES = {'scale_min': 'min_s', 'scale_max': 'max_s',
+               'rotation_min': 'min_r', 'rotation_max': 'max_r'}
+
+
+def load_recipe(path):
+    """Return the recipe dict stored in a JSON or YAML file"""
+    with open(path) as recipe_file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(recipe_file)
+        return json.load(recipe_file)
+
+
+def apply_recipe(scattering, recipe):
+    """Copy recipe values onto a Scatter object"""
+    for key, attr in RECIPE_ATTRS.items():
+        if key in recipe:
+            setattr(scattering, attr, recipe[key])
+    for key, prefix in RECIPE_AXES.items():
+        if key in recipe:
+            for axis, value in zip('xyz', recipe[key]):
+                setattr(scattering, prefix + axis, value)
+
+    import scatter
+    sources = recipe.get('source')
+    if sources:
+        if not isinstance(sources, list):
+            sources = scatter.parse_palette(sources)
+        scattering.source_palette = [tuple(entry) for entry in sources]
+
+    materials = recipe.get('materials')
+    if materials:
+        if not isinstance(materials, list):
+            materials = scatter.parse_palette(materials)
+        scattering.material_palette = [tuple(entry) for entry in materials]
+        scattering.materials = True
+
+    if 'frame_range' in recipe:
+        scattering.frame_range = tuple(recipe['frame_range'])
+    lod = recipe.get('lod')
+    if lod:
+        if not isinstance(lod, list):
+            lod = scatter.parse_palette(lod)
+        scattering.lod_proxies = [tuple(entry) for entry in lod]
+
+    density = recipe.get('density')
+    if density:
+        import scatter_density
+        scattering.density_map = scatter_density.DensityMap(**density)
+
+
+def init_worker():
+    """Start a standalone Maya session in a worker process"""
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+
+def job_process(job):
+    """Entry point of the process that runs a single job"""
+    init_worker()
+    run_job(job)
+
+
+def run_job(job):
+    """Scatter one scene, save its next version and return a report"""
+    scene, recipe, report_dir = job
+    import maya.cmds as cmds
+    import scatter
+    import smartsave
+
+    start = time.time()
+    report = {'scene': scene, 'status': 'ok', 'saved': None, 'points': 0,
+              'error': None}
+    try:
+        cmds.file(scene, open=True, force=True)
+        cmds.select(recipe['target'], replace=True)
+
+        scattering = scatter.Scatter()
+        apply_recipe(scattering, recipe)
+        scattering.creating_instances()
+        report['points'] = len(scattering.transforms)
+
+        scene_file = smartsave.SceneFile()
+        if recipe.get('save_task'):
+            scene_file.task = recipe['save_task']
+        scene_file.increment_save()
+        report['saved'] = str(scene_file.path)
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+
+    report['seconds'] = time.time() - start
+    write_report(report_dir, report)
+    return report
+
+
+def report_name(scene):
+    """Return '<scene name>_<folder hash>.json' for a scene's report.
+
+    The hash keeps same-named scenes from different shot folders apart.
+    """
+    folder = os.path.dirname(os.path.abspath(scene))
+    folder_hash = hashlib.md5(folder.encode('utf-8')).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(scene))[0]
+    return '{}_{}.json'.format(name, folder_hash)
+
+
+def write_report(report_dir, report):
+    """Write one job report as JSON named after its scene"""
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    name = report_name(report['scene'])
+    with open(os.path.join(report_dir, name), 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def read_report(report_dir, scene):
+    """Return the report a job wrote for scene, or None"""
+    path = os.path.join(report_dir, report_name(scene))
+    try:
+        with open(path) as report_file:
+            return json.load(report_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def clear_report(report_dir, scene):
+    """Remove a report left by an earlier run so it is not mistaken"""
+    path = os.path.join(report_dir, report_name(scene))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def run_jobs(jobs, workers, timeout=None):
+    """Run each job in its own process and return their reports.
+
+    A job whose process dies without writing a report, or that runs past
+    timeout seconds and is terminated, gets a report written for it.
+    """
+    pending = list(jobs)
+    running = []
+    reports = []
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop(0)
+            clear_report(job[2], job[0])
+            process = multiprocessing.Process(target=job_process,
+                                              args=(job,))
+            process.start()
+            running.append((process, job, time.time()))
+
+        time.sleep(POLL_SECONDS)
+        still_running = []
+        for process, job, start in running:
+            scene, _, report_dir = job
+            seconds = time.time() - start
+            if process.is_alive():
+                if timeout is None or seconds < timeout:
+                    still_running.append((process, job, start))
+                    continue
+                process.terminate()
+                process.join()
+                status = 'timeout'
+                error = "Terminated after {:.0f}s".format(seconds)
+            else:
+                process.join()
+                status = 'crashed'
+                error = "Worker exited with code {}".format(
+                    process.exitcode)
+
+            report = read_report(report_dir, scene)
+            if report is None:
+                report = {'scene': scene, 'status': status, 'saved': None,
+                          'points': 0, 'error': error, 'seconds': seconds}
+                write_report(report_dir, report)
+            reports.append(report)
+        running = still_running
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Scatter a recipe over scene files with mayapy")
+    parser.add_argument('recipe', help="JSON or YAML scatter recipe")
+    parser.add_argument('scenes', nargs='+', help="scene files to scatter")
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of mayapy worker processes")
+    parser.add_argument('--report-dir', default='scatter_reports',
+                        help="folder for the per-job JSON reports")
+    parser.add_argument('--timeout', type=float, default=3600.0,
+                        help="seconds before a job's process is killed; "
+                             "0 waits forever")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    recipe = load_recipe(args.recipe)
+    jobs = [(scene, recipe, args.report_dir) for scene in args.scenes]
+
+    reports = run_jobs(jobs, max(args.workers, 1), args.timeout or None)
+
+    failed = [report for report in reports if report['status'] != 'ok']
+    for report in reports:
+        log.info("%s: %s, %d points in %.1fs", report['scene'],
+                 report['status'], report['points'], report['seconds'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Benchmark the scatter pipeline against the in-memory Maya stand-in.
+
+    python scatter_benchmark.py --sizes 1000 100000 --json baseline.json
+
+For each synthetic mesh size this times the UI-to-model transfer,
+scatter_randomizer, creating_instances and scatter_materials, and reports
+wall time, peak traced memory and the number of Maya calls per stage.
+"""
+import argparse
+import json
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import maya_standin
+
+SCENE = maya_standin.install()
+
+import scatter
+import scatter_cache
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+class FakeWidget(object):
+    """Answers the value queries ScatterUI makes of its widgets"""
+
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def text(self):
+        return self._value
+
+    def isChecked(self):
+        return bool(self._value)
+
+    def checkState(self):
+        return self._value
+
+    def currentData(self):
+        return self._value
+
+    def currentText(self):
+        return self._value
+
+
+def fake_ui(scattering, options):
+    """Return a ScatterUI with fake widgets and no Qt window"""
+    widgets = {'obj1_le': 'rock', 'percent_dbspx': options.percentage,
+               'seed_spbx': 1, 'surface_ckbx': False,
+               'sample_count_spbx': 1000, 'min_distance_dbspx': 0.0,
+               'workers_spbx': options.workers,
+               'density_cmbx': None, 'density_le': '',
+               'density_channel_cmbx': 'luminance',
+               'camera_le': '', 'start_frame_dbspx': 1.0,
+               'end_frame_dbspx': 1.0, 'cull_margin_dbspx': 0.0,
+               'lod_le': '',
+               'align_normals_ckbx': True, 'bake_normals_ckbx': True,
+               'instancer_ckbx': options.instance_mode == 'instancer',
+               'materials_ckbx': True, 'material_le': 'rock_mat',
+               'material_dbsx': 0.5, 'update_ckbx': False,
+               'sx_min': 0.8, 'sx_max': 1.2, 'sy_min': 0.8, 'sy_max': 1.2,
+               'sz_min': 0.8, 'sz_max': 1.2,
+               'rx_min': 0, 'rx_max': 0, 'ry_min': 0, 'ry_max': 360,
+               'rz_min': 0, 'rz_max': 0}
+    ui = scatter.ScatterUI.__new__(scatter.ScatterUI)
+    ui.scattering = scattering
+    for name, value in widgets.items():
+        setattr(ui, name, FakeWidget(value))
+    return ui
+
+
+def measure(stage, func):
+    """Run func and return its wall time, peak memory and Maya calls"""
+    SCENE.calls.clear()
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    func()
+    seconds = time.time() - start
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'stage': stage, 'seconds': seconds, 'peak_bytes': peak,
+            'maya_calls': sum(SCENE.calls.values()),
+            'calls': dict(SCENE.calls)}
+
+
+def rerun_materials(scattering):
+    scattering.assigned_materials = {}
+    scattering.scatter_materials()
+
+
+def run_size(vertex_count, options):
+    """Return stage results for one synthetic mesh size"""
+    SCENE.reset()
+    SCENE.nodes['rock'] = {'type': 'transform'}
+    maya_standin.create_material('rock_mat')
+    SCENE.selection = [SCENE.add_grid_mesh('terrain', vertex_count)]
+
+    scattering = scatter.Scatter()
+    scattering.geometry_cache = scatter_cache.GeometryCache()
+    ui = fake_ui(scattering, options)
+
+    stages = [('ui_transfer', ui._scatter_properties_from_ui),
+              ('scatter_randomizer', scattering.scatter_randomizer),
+              ('creating_instances', scattering.creating_instances)]
+    if options.instance_mode == 'nodes':
+        stages.append(('scatter_materials',
+                       lambda: rerun_materials(scattering)))
+
+    results = []
+    for stage, func in stages:
+        result = measure(stage, func)
+        result['vertices'] = len(SCENE.meshes['terrain']['points'])
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark Scatter against a fake maya.cmds")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES,
+                        help="target mesh vertex counts")
+    parser.add_argument('--percentage', type=float, default=1.0,
+                        help="fraction of vertices to scatter on")
+    parser.add_argument('--instance-mode', default='nodes',
+                        choices=['nodes', 'instancer'])
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to compute the points")
+    parser.add_argument('--json', help="also write the results to this file")
+    options = parser.parse_args(argv)
+
+    results = []
+    print('{:>9} {:<20} {:>9} {:>10} {:>11}'.format(
+        'vertices', 'stage', 'seconds', 'peak MB', 'maya calls'))
+    for size in options.sizes:
+        for result in run_size(size, options):
+            peak = result['peak_bytes']
+            print('{:>9} {:<20} {:>9.3f} {:>10} {:>11}'.format(
+                result['vertices'], result['stage'], result['seconds'],
+                '-' if peak is None else '{:.1f}'.format(peak / 1048576.0),
+                result['maya_calls']))
+            results.append(result)
+
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
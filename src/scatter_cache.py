@@ -0,0 +1,96 @@
+import collections
+
+import maya.api.OpenMaya as om
+
+import scatter_engine
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+FINGERPRINT_SAMPLES = 32
+
+
+def array_bytes(value):
+    """Return the memory held by an array or a tuple of arrays"""
+    if isinstance(value, tuple):
+        return sum(array_bytes(val) for val in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class GeometryCache(object):
+    """Least recently used cache of per-mesh geometry arrays.
+
+    Entries are keyed on the mesh name and checked against a fingerprint
+    of its topology, world matrix and a few sampled points. A dirty
+    callback on the mesh also marks its entry stale as soon as it is
+    edited.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+
+    def fingerprint(self, mesh):
+        """Return a cheap key that changes when mesh topology or points do"""
+        fn_mesh = scatter_engine.mesh_fn(mesh)
+        count = fn_mesh.numVertices
+        step = max(count // FINGERPRINT_SAMPLES, 1)
+        samples = []
+        for idx in range(0, count, step)[:FINGERPRINT_SAMPLES]:
+            point = fn_mesh.getPoint(idx, om.MSpace.kWorld)
+            samples.append((point.x, point.y, point.z))
+        matrix = fn_mesh.dagPath().inclusiveMatrix()
+        return (count, fn_mesh.numPolygons, fn_mesh.numFaceVertices,
+                tuple(matrix[idx] for idx in range(16)), tuple(samples))
+
+    def get(self, mesh, kind, loader):
+        """Return loader(mesh), reusing the cached value when still valid"""
+        fingerprint = self.fingerprint(mesh)
+        entry = self.entries.get(mesh)
+        if entry is not None and (entry['stale'] or
+                                  entry['fingerprint'] != fingerprint):
+            self.invalidate(mesh)
+            entry = None
+        if entry is None:
+            entry = {'fingerprint': fingerprint, 'arrays': {},
+                     'stale': False, 'callback': self._watch(mesh)}
+        else:
+            del self.entries[mesh]
+        self.entries[mesh] = entry
+
+        if kind not in entry['arrays']:
+            value = loader(mesh)
+            entry['arrays'][kind] = value
+            self.nbytes += array_bytes(value)
+            self._evict(keep=mesh)
+        return entry['arrays'][kind]
+
+    def invalidate(self, mesh=None):
+        """Drop one mesh from the cache, or every mesh when mesh is None"""
+        meshes = list(self.entries) if mesh is None else [mesh]
+        for name in meshes:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                continue
+            self.nbytes -= sum(array_bytes(value)
+                               for value in entry['arrays'].values())
+            if entry['callback'] is not None:
+                om.MMessage.removeCallback(entry['callback'])
+
+    def _evict(self, keep):
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            if oldest == keep:
+                break
+            self.invalidate(oldest)
+
+    def _mark_stale(self, mesh):
+        if mesh in self.entries:
+            self.entries[mesh]['stale'] = True
+
+    def _watch(self, mesh):
+        node = scatter_engine.mesh_fn(mesh).object()
+        return om.MNodeMessage.addNodeDirtyCallback(
+            node, lambda *args: self._mark_stale(mesh))
+
+
+GEOMETRY_CACHE = GeometryCache()
@@ -0,0 +1,75 @@
+import maya.cmds as cmds
+import numpy as np
+
+MM_PER_INCH = 25.4
+
+
+class CameraView(object):
+    """A camera's world matrix and frustum on one frame"""
+
+    def __init__(self, world_matrix, tan_half_width, tan_half_height,
+                 near_clip, far_clip):
+        self.world_matrix = np.asarray(world_matrix,
+                                       dtype=np.float64).reshape(4, 4)
+        self.tan_half_width = tan_half_width
+        self.tan_half_height = tan_half_height
+        self.near_clip = near_clip
+        self.far_clip = far_clip
+
+    @property
+    def position(self):
+        return self.world_matrix[3, :3]
+
+    def to_camera_space(self, positions):
+        """Return positions in camera space, which looks down -Z"""
+        inverse = np.linalg.inv(self.world_matrix)
+        return positions.dot(inverse[:3, :3]) + inverse[3, :3]
+
+    def visible(self, positions, margin=0.0):
+        """Return a mask of positions inside the frustum grown by margin"""
+        local = self.to_camera_space(positions)
+        depth = -local[:, 2]
+        return ((depth > self.near_clip - margin) &
+                (depth < self.far_clip + margin) &
+                (np.abs(local[:, 0]) <
+                 depth * self.tan_half_width + margin) &
+                (np.abs(local[:, 1]) <
+                 depth * self.tan_half_height + margin))
+
+
+def camera_view(camera, frame):
+    """Return the CameraView of camera on frame"""
+    values = {}
+    for name in ('worldMatrix', 'focalLength', 'horizontalFilmAperture',
+                 'verticalFilmAperture', 'nearClipPlane', 'farClipPlane'):
+        values[name] = cmds.getAttr('{}.{}'.format(camera, name), time=frame)
+
+    inches_to_tan = MM_PER_INCH / 2.0 / values['focalLength']
+    return CameraView(values['worldMatrix'],
+                      values['horizontalFilmAperture'] * inches_to_tan,
+                      values['verticalFilmAperture'] * inches_to_tan,
+                      values['nearClipPlane'], values['farClipPlane'])
+
+
+def camera_views(camera, start, end, step=1.0):
+    """Return a CameraView for every step frames from start to end"""
+    count = int(np.floor((end - start) / step + 1e-9)) + 1
+    return [camera_view(camera, start + idx * step)
+            for idx in range(max(count, 1))]
+
+
+def cull_points(positions, views, margin=0.0):
+    """Return which positions any view sees and their nearest distance"""
+    seen = np.zeros(len(positions), dtype=bool)
+    nearest = np.full(len(positions), np.inf)
+    for view in views:
+        seen |= view.visible(positions, margin)
+        distance = np.linalg.norm(positions - view.position, axis=1)
+        np.minimum(nearest, distance, out=nearest)
+    return seen, nearest
+
+
+def lod_levels(distances, band_starts):
+    """Return 0 for points nearer than every band, else their band + 1"""
+    return np.searchsorted(np.asarray(band_starts, dtype=np.float64),
+                           distances, side='right').astype(np.int32)
@@ -0,0 +1,126 @@
+import os
+
+import maya.cmds as cmds
+import numpy as np
+
+import scatter_engine
+
+COLOR_SET = 'colorSet'
+WEIGHTS = 'weights'
+TEXTURE = 'texture'
+KINDS = [COLOR_SET, WEIGHTS, TEXTURE]
+
+LUMINANCE = 'luminance'
+CHANNELS = {'r': 0, 'g': 1, 'b': 2, 'a': 3}
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+
+def fetch_vertex_colors(mesh, color_set):
+    """Return (N,4) RGBA vertex colors, zero where none are set"""
+    colors = scatter_engine.mesh_fn(mesh).getVertexColors(color_set)
+    colors = np.array([(col.r, col.g, col.b, col.a) for col in colors],
+                      dtype=np.float64).reshape(-1, 4)
+    colors[colors[:, 0] < 0.0] = 0.0
+    return colors
+
+
+def fetch_vertex_uvs(mesh, uv_set=None):
+    """Return (N,2) UVs per vertex and a mask of vertices that have one"""
+    fn_mesh = scatter_engine.mesh_fn(mesh)
+    uv_args = (uv_set,) if uv_set else ()
+    us, vs = fn_mesh.getUVs(*uv_args)
+    uv_counts, uv_ids = fn_mesh.getAssignedUVs(*uv_args)
+    vert_counts, vert_ids = fn_mesh.getVertices()
+
+    # Faces without UVs have no entries in uv_ids, so skip their vertices
+    vert_counts = np.array(vert_counts, dtype=np.int64)
+    mapped = np.repeat(np.array(uv_counts) == vert_counts, vert_counts)
+    vert_ids = np.array(vert_ids, dtype=np.int64)[mapped]
+
+    uvs = np.zeros((fn_mesh.numVertices, 2))
+    has_uv = np.zeros(fn_mesh.numVertices, dtype=bool)
+    if len(vert_ids):
+        uv_table = np.column_stack((np.array(us), np.array(vs)))
+        uvs[vert_ids] = uv_table[np.array(uv_ids, dtype=np.int64)]
+        has_uv[vert_ids] = True
+    return uvs, has_uv
+
+
+def sample_texture(texture, uvs, alpha=False):
+    """Return (N,3) colors, or (N,1) alpha, of texture at uvs in one call"""
+    if not len(uvs):
+        return np.zeros((0, 1 if alpha else 3))
+    values = cmds.colorAtPoint(texture, output='A' if alpha else 'RGB',
+                               coordU=uvs[:, 0].tolist(),
+                               coordV=uvs[:, 1].tolist())
+    return np.array(values, dtype=np.float64).reshape(len(uvs), -1)
+
+
+def texture_signature(texture):
+    """Return the image path and mtime of a file texture, else None"""
+    if cmds.nodeType(texture) != 'file':
+        return None
+    path = cmds.getAttr(texture + '.fileTextureName') or ''
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    return '{}@{}'.format(path, mtime)
+
+
+class DensityMap(object):
+    """Where per-vertex scatter density in [0, 1] is read from.
+
+    name is a color set, a per-vertex doubleArray attribute on the mesh
+    (such as a painted weight map) or a texture node sampled at each
+    vertex's UV. Color channels are reduced to luminance unless channel
+    names one of r, g, b or a.
+    """
+
+    def __init__(self, kind, name, channel=LUMINANCE, uv_set=None):
+        if kind not in KINDS:
+            raise ValueError("Unknown density kind {!r}".format(kind))
+        self.kind = kind
+        self.name = name
+        self.channel = channel
+        self.uv_set = uv_set
+
+    def cache_key(self):
+        """Return the geometry cache kind the loaded densities live under.
+
+        Texture densities are keyed on the image file and its mtime, as
+        repainting it does not touch the mesh. None means the densities
+        cannot be cached, e.g. for a procedural texture.
+        """
+        key = 'density:{}:{}:{}:{}'.format(self.kind, self.name,
+                                           self.channel, self.uv_set)
+        if self.kind == TEXTURE:
+            signature = texture_signature(self.name)
+            if signature is None:
+                return None
+            key += ':' + signature
+        return key
+
+    def load(self, mesh):
+        """Return one density per vertex of mesh"""
+        if self.kind == WEIGHTS:
+            plug = self.name if '.' in self.name else '{}.{}'.format(
+                mesh, self.name)
+            weights = np.array(cmds.getAttr(plug) or [], dtype=np.float64)
+            density = np.zeros(scatter_engine.mesh_fn(mesh).numVertices)
+            count = min(len(weights), len(density))
+            density[:count] = weights[:count]
+        elif self.kind == COLOR_SET:
+            density = self._reduce(fetch_vertex_colors(mesh, self.name))
+        else:
+            uvs, has_uv = fetch_vertex_uvs(mesh, self.uv_set)
+            density = np.zeros(len(uvs))
+            alpha = self.channel == 'a'
+            colors = sample_texture(self.name, uvs[has_uv], alpha)
+            density[has_uv] = colors[:, 0] if alpha else self._reduce(colors)
+        return np.clip(density, 0.0, 1.0)
+
+    def _reduce(self, colors):
+        if self.channel == LUMINANCE:
+            return colors[:, :3].dot(LUMINANCE_WEIGHTS)
+        return colors[:, CHANNELS[self.channel]]
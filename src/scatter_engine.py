@@ -0,0 +1,208 @@
+import re
+
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+import numpy as np
+
+import scatter_rng
+
+COMPONENT_RANGE_RE = re.compile(r'^(?P<mesh>[^.]+)\.(?P<kind>\w+)'
+                                r'\[(?P<start>\d+|\*)(?::(?P<end>\d+))?\]$')
+COUNT_FLAGS = {'vtx': 'vertex', 'f': 'face'}
+CONVERSION_FLAGS = {'vtx': 'toVertex', 'f': 'toFace'}
+
+
+class MeshComponents(object):
+    """A mesh plus a compact, sorted array of component indices.
+
+    A scatter targets a single mesh, so a selection spanning several
+    meshes is refused rather than partly scattered.
+    """
+
+    def __init__(self, mesh=None, indices=None, kind='vtx'):
+        self.mesh = mesh
+        self.kind = kind
+        if indices is None:
+            indices = np.zeros(0, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_ranges(cls, ranges, kind='vtx'):
+        """Parse compressed names such as 'pPlane1.vtx[10:250]'.
+
+        Raises ValueError if the components span more than one mesh.
+        """
+        mesh = None
+        chunks = []
+        others = []
+        for comp in ranges:
+            match = COMPONENT_RANGE_RE.match(comp)
+            if not match or match.group('kind') != kind:
+                continue
+            if mesh is None:
+                mesh = match.group('mesh')
+            elif match.group('mesh') != mesh:
+                if match.group('mesh') not in others:
+                    others.append(match.group('mesh'))
+                continue
+
+            if match.group('start') == '*':
+                count = cmds.polyEvaluate(mesh, **{COUNT_FLAGS[kind]: True})
+                chunks.append(np.arange(count, dtype=np.int64))
+            else:
+                start = int(match.group('start'))
+                end = int(match.group('end') or start)
+                chunks.append(np.arange(start, end + 1, dtype=np.int64))
+
+        if others:
+            raise ValueError("Select one mesh per scatter, not {}".format(
+                ", ".join([mesh] + others)))
+        if not chunks:
+            return cls(kind=kind)
+        return cls(mesh, np.unique(np.concatenate(chunks)), kind)
+
+    @classmethod
+    def from_selection(cls, selection, kind='vtx'):
+        """Convert a selection to components without flattening it"""
+        if not selection:
+            return cls(kind=kind)
+        ranges = cmds.polyListComponentConversion(
+            selection, **{CONVERSION_FLAGS[kind]: True})
+        return cls.from_ranges(ranges or [], kind)
+
+    def names(self, indices=None):
+        """Return flattened component names for commands that need them"""
+        if indices is None:
+            indices = self.indices
+        return ['{}.{}[{}]'.format(self.mesh, self.kind, idx)
+                for idx in indices]
+
+
+def mesh_fn(mesh):
+    """Return an MFnMesh for a mesh or its transform"""
+    sel = om.MSelectionList()
+    sel.add(mesh)
+    return om.MFnMesh(sel.getDagPath(0))
+
+
+def vector_array(values):
+    """Return an (N,3) array from an MPointArray or MFloatVectorArray"""
+    return np.array([(val.x, val.y, val.z) for val in values],
+                    dtype=np.float64).reshape(-1, 3)
+
+
+def fetch_points(mesh):
+    """Return an (N,3) array of every world vertex position of mesh"""
+    return vector_array(mesh_fn(mesh).getPoints(om.MSpace.kWorld))
+
+
+def fetch_normals(mesh):
+    """Return an (N,3) array of every world vertex normal of mesh"""
+    normals = mesh_fn(mesh).getVertexNormals(False, om.MSpace.kWorld)
+    return vector_array(normals)
+
+
+def euler_to_matrices(rotations):
+    """Return (N,3,3) matrices for xyz-order Euler rotations in degrees"""
+    rx, ry, rz = np.radians(rotations).T
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+
+    matrices = np.empty((len(rotations), 3, 3))
+    matrices[:, 0, 0] = cz * cy
+    matrices[:, 0, 1] = cz * sy * sx - sz * cx
+    matrices[:, 0, 2] = cz * sy * cx + sz * sx
+    matrices[:, 1, 0] = sz * cy
+    matrices[:, 1, 1] = sz * sy * sx + cz * cx
+    matrices[:, 1, 2] = sz * sy * cx - cz * sx
+    matrices[:, 2, 0] = -sy
+    matrices[:, 2, 1] = cy * sx
+    matrices[:, 2, 2] = cy * cx
+    return matrices
+
+
+def matrices_to_euler(matrices):
+    """Return xyz-order Euler rotations in degrees for (N,3,3) matrices"""
+    sy = np.clip(-matrices[:, 2, 0], -1.0, 1.0)
+    ry = np.arcsin(sy)
+    rx = np.arctan2(matrices[:, 2, 1], matrices[:, 2, 2])
+    rz = np.arctan2(matrices[:, 1, 0], matrices[:, 0, 0])
+
+    gimbal = np.abs(sy) > 1.0 - 1e-9
+    rx[gimbal] = 0.0
+    rz[gimbal] = np.arctan2(-matrices[gimbal, 0, 1], matrices[gimbal, 1, 1])
+    return np.degrees(np.column_stack((rx, ry, rz)))
+
+
+def normal_frames(normals, world_up=(0.0, 1.0, 0.0)):
+    """Return (N,3,3) frames aiming local X along normals, Y toward up.
+
+    This matches the default aim and up vectors of cmds.normalConstraint.
+    """
+    aim = normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    up = np.tile(np.asarray(world_up, dtype=np.float64), (len(aim), 1))
+    parallel = np.abs(np.einsum('ij,ij->i', aim, up)) > 0.999
+    up[parallel] = (0.0, 0.0, 1.0)
+
+    side = np.cross(aim, up)
+    side /= np.linalg.norm(side, axis=1)[:, np.newaxis]
+    up = np.cross(side, aim)
+    return np.stack((aim, up, side), axis=2)
+
+
+def align_rotations(rotations, normals):
+    """Return Euler rotations that apply rotations inside normal frames"""
+    frames = normal_frames(normals)
+    aligned = np.matmul(frames, euler_to_matrices(rotations))
+    return matrices_to_euler(aligned)
+
+
+class TransformBuffer(object):
+    """Per-point translation, rotation and scale for a whole scatter.
+
+    material_ids index the material palette (-1 keeps the source's
+    shading) and source_ids index the scattered objects.
+    """
+
+    def __init__(self, positions, rotations, scales, point_ids,
+                 material_ids=None, source_ids=None):
+        self.positions = positions
+        self.rotations = rotations
+        self.scales = scales
+        self.point_ids = point_ids
+        self.material_ids = material_ids
+        self.source_ids = source_ids
+
+    def __len__(self):
+        return len(self.positions)
+
+    def source_id_array(self):
+        """Return source_ids, or zeros when every point uses one source"""
+        if self.source_ids is None:
+            return np.zeros(len(self), dtype=np.int32)
+        return self.source_ids
+
+    def transform(self, idx):
+        """Return translation, rotation and scale lists for one point"""
+        return (self.positions[idx].tolist(),
+                self.rotations[idx].tolist(),
+                self.scales[idx].tolist())
+
+
+def random_transforms(positions, point_ids, seed, scale_range,
+                      rotation_range):
+    """Build a TransformBuffer for positions with seeded random values.
+
+    scale_range and rotation_range are (mins, maxs) pairs of xyz values.
+    Random values are keyed on point_ids so they stay put when the
+    selection grows or shrinks.
+    """
+    scale_stream = scatter_rng.RandomStream(seed, scatter_rng.SCALE)
+    rotation_stream = scatter_rng.RandomStream(seed, scatter_rng.ROTATION)
+    scales = scale_stream.uniform(point_ids, *scale_range)
+    rotations = rotation_stream.uniform(point_ids, *rotation_range)
+    return TransformBuffer(positions, rotations, scales, point_ids)
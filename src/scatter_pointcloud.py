@@ -0,0 +1,133 @@
+"""Compact binary point clouds of scatter results.
+
+A file is a fixed header, one packed POINT_DTYPE record per point and a
+JSON table naming the material and source ids. The records can be
+memory-mapped, so loading a large scatter does not parse anything.
+"""
+import json
+import struct
+
+import numpy as np
+
+import scatter_engine
+
+MAGIC = b'SCPC'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQQ')
+POINT_DTYPE = np.dtype([('point_id', '<i8'),
+                        ('position', '<f4', (3,)),
+                        ('orientation', '<f4', (4,)),
+                        ('scale', '<f4', (3,)),
+                        ('material_id', '<i4'),
+                        ('source_id', '<i4')])
+
+
+def matrices_to_quaternions(matrices):
+    """Return (N,4) xyzw unit quaternions for (N,3,3) rotation matrices.
+
+    Uses Shepperd's method: each row is solved from whichever of x, y, z
+    or w is largest, so the other components keep their relative signs
+    even for 180 degree turns, where the off-diagonal differences vanish.
+    """
+    m = matrices
+    # 4 * the squares of x, y, z and w
+    squares = np.stack([1.0 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+                        1.0 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2],
+                        1.0 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2],
+                        1.0 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]], axis=1)
+    # 4 * the pairwise products
+    xy = m[:, 0, 1] + m[:, 1, 0]
+    xz = m[:, 0, 2] + m[:, 2, 0]
+    yz = m[:, 1, 2] + m[:, 2, 1]
+    xw = m[:, 2, 1] - m[:, 1, 2]
+    yw = m[:, 0, 2] - m[:, 2, 0]
+    zw = m[:, 1, 0] - m[:, 0, 1]
+    products = np.stack([
+        np.stack([squares[:, 0], xy, xz, xw], axis=1),
+        np.stack([xy, squares[:, 1], yz, yw], axis=1),
+        np.stack([xz, yz, squares[:, 2], zw], axis=1),
+        np.stack([xw, yw, zw, squares[:, 3]], axis=1)], axis=1)
+
+    rows = np.arange(len(m))
+    largest = np.argmax(squares, axis=1)
+    quats = products[rows, largest] / (
+        2.0 * np.sqrt(squares[rows, largest]))[:, np.newaxis]
+    return quats / np.linalg.norm(quats, axis=1)[:, np.newaxis]
+
+
+def quaternions_to_matrices(quats):
+    """Return (N,3,3) rotation matrices for (N,4) xyzw quaternions"""
+    x, y, z, w = np.asarray(quats, dtype=np.float64).T
+    matrices = np.empty((len(x), 3, 3))
+    matrices[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    matrices[:, 0, 1] = 2.0 * (x * y - z * w)
+    matrices[:, 0, 2] = 2.0 * (x * z + y * w)
+    matrices[:, 1, 0] = 2.0 * (x * y + z * w)
+    matrices[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    matrices[:, 1, 2] = 2.0 * (y * z - x * w)
+    matrices[:, 2, 0] = 2.0 * (x * z - y * w)
+    matrices[:, 2, 1] = 2.0 * (y * z + x * w)
+    matrices[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return matrices
+
+
+class PointCloud(object):
+    """Transforms plus the names their material and source ids refer to"""
+
+    def __init__(self, transforms, materials=None, sources=None):
+        self.transforms = transforms
+        self.materials = materials or []
+        self.sources = sources or []
+
+
+def write_points(path, cloud):
+    """Write a PointCloud as a header, packed records and a name table"""
+    transforms = cloud.transforms
+    count = len(transforms)
+    records = np.zeros(count, dtype=POINT_DTYPE)
+    records['point_id'] = transforms.point_ids
+    records['position'] = transforms.positions
+    records['orientation'] = matrices_to_quaternions(
+        scatter_engine.euler_to_matrices(transforms.rotations))
+    records['scale'] = transforms.scales
+    records['material_id'] = -1
+    if transforms.material_ids is not None:
+        records['material_id'] = transforms.material_ids
+    records['source_id'] = transforms.source_id_array()
+
+    names = json.dumps({'materials': cloud.materials,
+                        'sources': cloud.sources}).encode('utf-8')
+    with open(path, 'wb') as cloud_file:
+        cloud_file.write(HEADER.pack(MAGIC, VERSION, count,
+                                     POINT_DTYPE.itemsize, len(names)))
+        records.tofile(cloud_file)
+        cloud_file.write(names)
+
+
+def map_points(path):
+    """Return the memory-mapped records and the name table of a file"""
+    with open(path, 'rb') as cloud_file:
+        magic, version, count, itemsize, names_len = HEADER.unpack(
+            cloud_file.read(HEADER.size))
+        if magic != MAGIC or itemsize != POINT_DTYPE.itemsize:
+            raise ValueError("{} is not a scatter point cloud".format(path))
+        cloud_file.seek(HEADER.size + count * itemsize)
+        names = json.loads(cloud_file.read(names_len).decode('utf-8'))
+
+    records = np.memmap(path, dtype=POINT_DTYPE, mode='r',
+                        offset=HEADER.size, shape=(count,))
+    return records, names
+
+
+def read_points(path):
+    """Return a PointCloud built from a memory-mapped point cloud file"""
+    records, names = map_points(path)
+    rotations = scatter_engine.matrices_to_euler(
+        quaternions_to_matrices(records['orientation']))
+    transforms = scatter_engine.TransformBuffer(
+        records['position'].astype(np.float64), rotations,
+        records['scale'].astype(np.float64),
+        np.array(records['point_id']),
+        material_ids=np.array(records['material_id']),
+        source_ids=np.array(records['source_id']))
+    return PointCloud(transforms, names['materials'], names['sources'])
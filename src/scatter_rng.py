@@ -0,0 +1,69 @@
+import zlib
+
+import numpy as np
+
+SELECTION = 'selection'
+SCALE = 'scale'
+ROTATION = 'rotation'
+MATERIAL = 'material'
+SURFACE = 'surface'
+SOURCE = 'source'
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_DRAW_STEP = np.uint64(0xD1B54A32D192ED03)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(values):
+    """Return the splitmix64 finalizer of a uint64 array"""
+    with np.errstate(over='ignore'):
+        values = values ^ (values >> np.uint64(30))
+        values = values * _MIX1
+        values = values ^ (values >> np.uint64(27))
+        values = values * _MIX2
+        return values ^ (values >> np.uint64(31))
+
+
+class RandomStream(object):
+    """Counter-based random numbers for one purpose of one scatter seed.
+
+    Every value is a pure function of (seed, purpose, index, draw), so a
+    point keeps its numbers no matter how many other points there are and
+    streams with different purposes are independent of each other.
+    """
+
+    def __init__(self, seed, purpose):
+        self.seed = seed
+        self.purpose = purpose
+        purpose_key = zlib.crc32(purpose.encode('utf-8')) & 0xffffffff
+        key = np.array([(int(seed) & 0xffffffff) << 32 | purpose_key],
+                       dtype=np.uint64)
+        self._key = _mix(key)[0]
+
+    def random(self, indices, draw=0):
+        """Return one float in [0, 1) per index"""
+        indices = np.asarray(indices).astype(np.uint64)
+        with np.errstate(over='ignore'):
+            counter = (indices * _GOLDEN + np.uint64(draw) * _DRAW_STEP
+                       + self._key)
+        bits = _mix(_mix(counter)) >> np.uint64(11)
+        return bits.astype(np.float64) * (1.0 / (1 << 53))
+
+    def uniform(self, indices, mins, maxs):
+        """Return a (len(indices), k) array between per-column limits"""
+        mins = np.asarray(mins, dtype=np.float64)
+        maxs = np.asarray(maxs, dtype=np.float64)
+        columns = [self.random(indices, draw) for draw in range(len(mins))]
+        return mins + (maxs - mins) * np.column_stack(columns)
+
+    def mask(self, indices, probability):
+        """Return a boolean array accepting each index with probability"""
+        return self.random(indices) < probability
+
+    def choice(self, indices, weights, draw=1):
+        """Return a weighted pick into weights for each index"""
+        cumulative = np.cumsum(np.asarray(weights, dtype=np.float64))
+        picks = self.random(indices, draw) * cumulative[-1]
+        choices = np.searchsorted(cumulative, picks, side='right')
+        return np.minimum(choices, len(cumulative) - 1)
@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+
+import scatter_engine
+
+NEIGHBOUR_OFFSETS = [(x, y, z) for x in (-1, 0, 1)
+                     for y in (-1, 0, 1)
+                     for z in (-1, 0, 1)]
+
+
+class SpatialHashGrid(object):
+    """Uniform hash grid for constant time minimum-distance checks"""
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+
+    def cell(self, point):
+        return tuple(int(math.floor(val / self.cell_size)) for val in point)
+
+    def insert(self, point):
+        self.cells.setdefault(self.cell(point), []).append(point)
+
+    def has_neighbour(self, point, radius):
+        """Return whether a stored point lies closer than radius"""
+        radius_sq = radius * radius
+        cx, cy, cz = self.cell(point)
+        px, py, pz = point
+        for ox, oy, oz in NEIGHBOUR_OFFSETS:
+            for qx, qy, qz in self.cells.get((cx + ox, cy + oy, cz + oz), ()):
+                dist_sq = (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+                if dist_sq < radius_sq:
+                    return True
+        return False
+
+
+def fetch_triangles(mesh):
+    """Return world points, (T,3) triangle vertex ids and their face ids"""
+    fn_mesh = scatter_engine.mesh_fn(mesh)
+    counts, tri_verts = fn_mesh.getTriangles()
+    points = scatter_engine.vector_array(
+        fn_mesh.getPoints(scatter_engine.om.MSpace.kWorld))
+
+    triangles = np.array(tri_verts, dtype=np.int64).reshape(-1, 3)
+    tri_faces = np.repeat(np.arange(len(counts)), np.array(counts))
+    return points, triangles, tri_faces
+
+
+def select_triangles(triangles, tri_faces, face_ids):
+    """Return the rows of triangles that belong to face_ids"""
+    return np.flatnonzero(np.isin(tri_faces, face_ids))
+
+
+def triangle_areas(points, triangles):
+    """Return the area of every triangle"""
+    edge1 = points[triangles[:, 1]] - points[triangles[:, 0]]
+    edge2 = points[triangles[:, 2]] - points[triangles[:, 0]]
+    return 0.5 * np.linalg.norm(np.cross(edge1, edge2), axis=1)
+
+
+def sample_triangles(points, triangles, areas, sample_ids, stream):
+    """Return positions and normals of area-weighted surface samples"""
+    cumulative = np.cumsum(areas)
+    picks = stream.random(sample_ids, 0) * cumulative[-1]
+    tri_idx = np.searchsorted(cumulative, picks, side='right')
+    tri_idx = np.minimum(tri_idx, len(triangles) - 1)
+    corners = triangles[tri_idx]
+
+    root_u = np.sqrt(stream.random(sample_ids, 1))[:, np.newaxis]
+    v = stream.random(sample_ids, 2)[:, np.newaxis]
+    pt0 = points[corners[:, 0]]
+    pt1 = points[corners[:, 1]]
+    pt2 = points[corners[:, 2]]
+    positions = ((1.0 - root_u) * pt0 + root_u * (1.0 - v) * pt1 +
+                 root_u * v * pt2)
+
+    normals = np.cross(pt1 - pt0, pt2 - pt0)
+    normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    return positions, normals
+
+
+def poisson_filter(positions, min_distance, limit=None):
+    """Return indices of positions kept by greedy blue-noise rejection"""
+    grid = SpatialHashGrid(min_distance)
+    kept = []
+    for idx, point in enumerate(positions.tolist()):
+        if grid.has_neighbour(point, min_distance):
+            continue
+        grid.insert(point)
+        kept.append(idx)
+        if limit is not None and len(kept) >= limit:
+            break
+    return np.array(kept, dtype=np.int64)
@@ -0,0 +1,296 @@
+"""Deterministic point generation that can be split over processes.
+
+Every value a point gets is a pure function of its id and the settings,
+so computing candidate index ranges separately and concatenating the
+results in order is bit-identical to one pass over all of them. Only the
+blue-noise thinning of surface samples is sequential; it runs in the
+calling process between the two sharded phases.
+"""
+import contextlib
+import logging
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import scatter_camera
+import scatter_engine
+import scatter_rng
+import scatter_sampling
+
+log = logging.getLogger(__name__)
+
+SHARDS_PER_WORKER = 4
+MIN_SHARD_POINTS = 50000
+
+_shared = {}
+
+
+class PointSettings(object):
+    """The Scatter settings that point generation depends on"""
+
+    def __init__(self, seed, surface=False, sample_count=1000,
+                 min_distance=0.0, oversample=4, scatter_percentage=1.0,
+                 scale_range=((1.0,) * 3, (1.0,) * 3),
+                 rotation_range=((0.0,) * 3, (0.0,) * 3),
+                 align_normals=False, material_weights=None,
+                 materials_percentage=1.0, source_weights=None,
+                 lod_distances=(), variant_count=1, cull_margin=0.0):
+        self.seed = seed
+        self.surface = surface
+        self.sample_count = sample_count
+        self.min_distance = min_distance
+        self.oversample = oversample
+        self.scatter_percentage = scatter_percentage
+        self.scale_range = scale_range
+        self.rotation_range = rotation_range
+        self.align_normals = align_normals
+        self.material_weights = material_weights
+        self.materials_percentage = materials_percentage
+        self.source_weights = source_weights
+        self.lod_distances = lod_distances
+        self.variant_count = variant_count
+        self.cull_margin = cull_margin
+
+    def thins_samples(self):
+        return self.surface and self.min_distance > 0.0
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield {'items': None}
+
+
+def _stage(profiler, name):
+    return profiler.stage(name) if profiler else _no_stage()
+
+
+def select_vertices(settings, vertex_ids, density=None):
+    """Return the vertex ids accepted by the seeded selection stream"""
+    stream = scatter_rng.RandomStream(settings.seed, scatter_rng.SELECTION)
+    probability = settings.scatter_percentage
+    if density is not None:
+        probability = probability * density[vertex_ids]
+    return vertex_ids[stream.mask(vertex_ids, probability)]
+
+
+def variant_ids(settings, point_ids):
+    """Return a weighted pick into the source variants for each point"""
+    if not settings.source_weights:
+        return np.zeros(len(point_ids), dtype=np.int32)
+    stream = scatter_rng.RandomStream(settings.seed, scatter_rng.SOURCE)
+    return stream.choice(point_ids, settings.source_weights,
+                         draw=0).astype(np.int32)
+
+
+def material_ids(settings, point_ids):
+    """Return the palette index for each point, -1 for no material"""
+    ids = np.full(len(point_ids), -1, dtype=np.int32)
+    if not settings.material_weights:
+        return ids
+    stream = scatter_rng.RandomStream(settings.seed, scatter_rng.MATERIAL)
+    keep = np.flatnonzero(stream.mask(point_ids,
+                                      settings.materials_percentage))
+    ids[keep] = stream.choice(point_ids[keep], settings.material_weights)
+    return ids
+
+
+def candidate_count(settings, geometry):
+    """Return how many candidate points the geometry yields"""
+    if not settings.surface:
+        return len(geometry['vertex_ids'])
+    areas = geometry.get('areas')
+    if (not settings.sample_count or not len(geometry['triangles']) or
+            areas is None or areas.sum() <= 0.0):
+        return 0
+    if settings.thins_samples():
+        return settings.sample_count * settings.oversample
+    return settings.sample_count
+
+
+def candidate_points(settings, geometry, start, stop):
+    """Return positions, normals and ids of candidates start:stop"""
+    if settings.surface:
+        if stop <= start:
+            return np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0, np.int64)
+        sample_ids = np.arange(start, stop, dtype=np.int64)
+        stream = scatter_rng.RandomStream(settings.seed, scatter_rng.SURFACE)
+        positions, normals = scatter_sampling.sample_triangles(
+            geometry['points'], geometry['triangles'], geometry['areas'],
+            sample_ids, stream)
+        return positions, normals, sample_ids
+
+    point_ids = select_vertices(settings, geometry['vertex_ids'][start:stop],
+                                geometry.get('density'))
+    normals = geometry.get('normals')
+    if normals is not None:
+        normals = normals[point_ids]
+    return geometry['points'][point_ids], normals, point_ids
+
+
+def thin_points(settings, positions, normals, point_ids):
+    """Return the blue-noise subset of surface candidates"""
+    if not settings.thins_samples():
+        return positions, normals, point_ids
+    keep = scatter_sampling.poisson_filter(positions, settings.min_distance,
+                                           limit=settings.sample_count)
+    return positions[keep], normals[keep], point_ids[keep]
+
+
+def finish_points(settings, positions, normals, point_ids, views=None,
+                  profiler=None):
+    """Cull points and return their TransformBuffer"""
+    source_ids = variant_ids(settings, point_ids)
+    if views:
+        with _stage(profiler, 'culling') as stage:
+            seen, nearest = scatter_camera.cull_points(positions, views,
+                                                       settings.cull_margin)
+            positions, point_ids = positions[seen], point_ids[seen]
+            if normals is not None:
+                normals = normals[seen]
+            levels = scatter_camera.lod_levels(nearest[seen],
+                                               settings.lod_distances)
+            source_ids = np.where(levels == 0, source_ids[seen],
+                                  settings.variant_count + levels - 1)
+            stage['items'] = len(point_ids)
+
+    with _stage(profiler, 'transforms') as stage:
+        transforms = scatter_engine.random_transforms(
+            positions, point_ids, settings.seed, settings.scale_range,
+            settings.rotation_range)
+        transforms.material_ids = material_ids(settings, point_ids)
+        transforms.source_ids = source_ids.astype(np.int32)
+        stage['items'] = len(transforms)
+
+    if settings.align_normals and len(transforms):
+        with _stage(profiler, 'normal_alignment') as stage:
+            transforms.rotations = scatter_engine.align_rotations(
+                transforms.rotations, normals)
+            stage['items'] = len(transforms)
+    return transforms
+
+
+def compute_points(settings, geometry, profiler=None):
+    """Return the TransformBuffer for every candidate in this process"""
+    with _stage(profiler, 'masking') as stage:
+        points = candidate_points(settings, geometry, 0,
+                                  candidate_count(settings, geometry))
+        points = thin_points(settings, *points)
+        stage['items'] = len(points[2])
+    return finish_points(settings, *points, views=geometry.get('views'),
+                         profiler=profiler)
+
+
+def shard_ranges(count, shards):
+    """Return (start, stop) pairs splitting range(count) into shards"""
+    bounds = np.linspace(0, count, max(shards, 1) + 1).astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in
+            zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def merge_transforms(buffers):
+    """Concatenate TransformBuffers computed for consecutive shards"""
+    fields = ['positions', 'rotations', 'scales', 'point_ids',
+              'material_ids', 'source_ids']
+    merged = [np.concatenate([getattr(buf, name) for buf in buffers])
+              for name in fields]
+    return scatter_engine.TransformBuffer(*merged[:4],
+                                          material_ids=merged[4],
+                                          source_ids=merged[5])
+
+
+def worker_executable():
+    """Return mayapy when running inside the Maya GUI, else None.
+
+    Spawned workers would otherwise start another interactive Maya.
+    """
+    name = os.path.basename(sys.executable).lower()
+    if not name.startswith('maya') or name.startswith('mayapy'):
+        return None
+    suffix = '.exe' if sys.platform == 'win32' else ''
+    return os.path.join(os.path.dirname(sys.executable), 'mayapy' + suffix)
+
+
+def process_context():
+    """Return what to start worker processes from, None if unsafe.
+
+    Forking the interactive Maya would copy a multithreaded Qt process,
+    so inside the GUI workers are spawned as fresh mayapy processes.
+    Python 2 can only spawn on Windows, so elsewhere the GUI gets none.
+    """
+    executable = worker_executable()
+    if executable is None:
+        return multiprocessing
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(executable)
+        return context
+    if sys.platform == 'win32':
+        multiprocessing.set_executable(executable)
+        return multiprocessing
+    return None
+
+
+def _init_worker(settings, geometry):
+    _shared['settings'] = settings
+    _shared['geometry'] = geometry
+
+
+def _candidate_shard(bounds):
+    return candidate_points(_shared['settings'], _shared['geometry'],
+                            *bounds)
+
+
+def _finish_shard(points):
+    return finish_points(_shared['settings'], *points,
+                         views=_shared['geometry'].get('views'))
+
+
+def _full_shard(bounds):
+    return _finish_shard(_candidate_shard(bounds))
+
+
+def _slice_points(points, bounds):
+    start, stop = bounds
+    return tuple(None if values is None else values[start:stop]
+                 for values in points)
+
+
+def compute_points_parallel(settings, geometry, workers, profiler=None):
+    """Return compute_points() results computed on a process pool"""
+    count = candidate_count(settings, geometry)
+    context = process_context()
+    if context is None:
+        log.warning("Worker processes cannot be started from this Maya "
+                    "session; computing points in one process.")
+    if not count or context is None:
+        return compute_points(settings, geometry, profiler)
+
+    pool = context.Pool(workers, initializer=_init_worker,
+                        initargs=(settings, geometry))
+    try:
+        ranges = shard_ranges(count, workers * SHARDS_PER_WORKER)
+        if not settings.thins_samples():
+            with _stage(profiler, 'shards') as stage:
+                buffers = pool.map(_full_shard, ranges, chunksize=1)
+                stage['items'] = count
+        else:
+            with _stage(profiler, 'masking') as stage:
+                shards = pool.map(_candidate_shard, ranges, chunksize=1)
+                points = thin_points(settings, *[
+                    np.concatenate([shard[idx] for shard in shards])
+                    for idx in range(3)])
+                stage['items'] = len(points[2])
+            with _stage(profiler, 'shards') as stage:
+                ranges = shard_ranges(len(points[2]),
+                                      workers * SHARDS_PER_WORKER)
+                buffers = pool.map(
+                    _finish_shard,
+                    [_slice_points(points, bounds) for bounds in ranges],
+                    chunksize=1)
+                stage['items'] = len(points[2])
+    finally:
+        pool.close()
+        pool.join()
+    return merge_transforms(buffers)
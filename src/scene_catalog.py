@@ -0,0 +1,249 @@
+"""Project-wide catalog of scene versions kept in a SQLite file.
+
+refresh() walks the scenes tree with a pool of threads, one directory
+listing per task, so the round trips to a network filesystem overlap.
+Known directories are only stat'ed; a directory is listed again when its
+mtime moves, which happens when entries are added, removed or renamed in
+it. A file overwritten in place keeps its old size and mtime in the
+catalog until its directory changes.
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import scene_versions
+
+SCAN_THREADS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    racy INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    descriptor TEXT NOT NULL,
+    task TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    ver INTEGER NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS scenes_version
+    ON scenes (dir, descriptor, task, ext, ver);
+"""
+
+
+def default_db_path(root):
+    """Return a local path for the catalog of root.
+
+    SQLite locking is unreliable over NFS, so the index lives on the
+    local disk rather than next to the scenes it describes.
+    """
+    digest = hashlib.md5(scene_versions.folder_key(root)
+                         .encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), 'smartsave',
+                        'catalog_{}.sqlite'.format(digest))
+
+
+def scan_dir(path):
+    """List one directory; return (path, mtime, racy, scenes, subdirs)"""
+    scanned_at = time.time()
+    mtime = scene_versions.folder_mtime(path)
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return path, None, False, [], []
+
+    scenes = []
+    subdirs = []
+    for name in names:
+        full_path = os.path.join(path, name)
+        try:
+            info = os.stat(full_path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(info.st_mode):
+            # Hidden folders hold bookkeeping such as version placeholders
+            if not name.startswith('.') and not os.path.islink(full_path):
+                subdirs.append(scene_versions.folder_key(full_path))
+            continue
+        parsed = scene_versions.parse_scene_name(name)
+        if parsed:
+            (descriptor, task, ext), ver = parsed
+            scenes.append((path, name, descriptor, task, ext, ver,
+                           info.st_size, info.st_mtime))
+    racy = (mtime is not None and
+            scanned_at - mtime <= scene_versions.RACY_SECONDS)
+    return path, mtime, racy, scenes, subdirs
+
+
+class SceneCatalog(object):
+    """Every scene version under root, indexed in a SQLite file"""
+
+    def __init__(self, root, db_path=None, threads=SCAN_THREADS):
+        self.root = scene_versions.folder_key(root)
+        self.db_path = str(db_path or default_db_path(root))
+        self.threads = threads
+        self._lock = threading.Lock()
+        folder = os.path.dirname(self.db_path)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Yield a connection that commits when the block succeeds"""
+        db = sqlite3.connect(self.db_path, timeout=30.0)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _map(self, func, items):
+        if len(items) < 2:
+            return [func(item) for item in items]
+        pool = ThreadPool(min(self.threads, len(items)))
+        try:
+            return pool.map(func, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _forget(self, db, path):
+        db.execute('DELETE FROM dirs WHERE path = ?', (path,))
+        db.execute('DELETE FROM scenes WHERE dir = ?', (path,))
+
+    def _walk(self, frontier, known):
+        """List frontier and any new directories below it.
+
+        Directories are listed without holding the lock, which is only
+        taken to write each level's results, so saves recorded during a
+        long walk are not kept waiting. A listing stored after a newer
+        one keeps its older mtime, so the next refresh lists it again.
+        """
+        listed = 0
+        while frontier:
+            results = self._map(scan_dir, frontier)
+            listed += len(results)
+            frontier = []
+            with self._lock, self._connect() as db:
+                for path, mtime, racy, scenes, subdirs in results:
+                    if mtime is None:
+                        self._forget(db, path)
+                        continue
+                    db.execute('DELETE FROM scenes WHERE dir = ?', (path,))
+                    db.executemany('INSERT OR REPLACE INTO scenes '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', scenes)
+                    db.execute('INSERT OR REPLACE INTO dirs '
+                               'VALUES (?, ?, ?)', (path, mtime, int(racy)))
+                    for subdir in subdirs:
+                        if subdir not in known:
+                            known.add(subdir)
+                            frontier.append(subdir)
+        return listed
+
+    def refresh(self):
+        """Rescan the directories that changed; return how many were listed"""
+        with self._connect() as db:
+            rows = db.execute('SELECT path, mtime, racy FROM dirs').fetchall()
+        mtimes = self._map(scene_versions.folder_mtime,
+                           [row[0] for row in rows])
+        frontier = []
+        gone = []
+        for (path, mtime, racy), current in zip(rows, mtimes):
+            if current is None:
+                gone.append(path)
+            elif racy or current != mtime:
+                frontier.append(path)
+        if gone:
+            with self._lock, self._connect() as db:
+                for path in gone:
+                    self._forget(db, path)
+        known = set(row[0] for row in rows)
+        if self.root not in known:
+            known.add(self.root)
+            frontier.append(self.root)
+        return self._walk(frontier, known)
+
+    def refresh_folder(self, folder):
+        """Rescan one folder if it changed; return directories listed"""
+        path = scene_versions.folder_key(folder)
+        with self._connect() as db:
+            row = db.execute('SELECT mtime, racy FROM dirs WHERE path = ?',
+                             (path,)).fetchone()
+            known = set(known_path for known_path, in
+                        db.execute('SELECT path FROM dirs'))
+        if row and not row[1] and \
+                scene_versions.folder_mtime(path) == row[0]:
+            return 0
+        known.add(path)
+        return self._walk([path], known)
+
+    def record(self, path):
+        """Add a scene this process just wrote without a rescan"""
+        folder, name = os.path.split(str(path))
+        parsed = scene_versions.parse_scene_name(name)
+        if not parsed:
+            return
+        (descriptor, task, ext), ver = parsed
+        try:
+            info = os.stat(str(path))
+            size, mtime = info.st_size, info.st_mtime
+        except OSError:
+            size = mtime = None
+        with self._lock, self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO scenes '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (scene_versions.folder_key(folder), name, descriptor,
+                        task, ext, ver, size, mtime))
+
+    def latest(self, folder, key):
+        """Return the highest cataloged version of key in folder, or 0"""
+        descriptor, task, ext = key
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT MAX(ver) FROM scenes WHERE dir = ? AND '
+                'descriptor = ? AND task = ? AND ext = ?',
+                (scene_versions.folder_key(folder), descriptor, task,
+                 ext)).fetchone()
+        return row[0] or 0
+
+    def versions(self, folder, key):
+        """Return (ver, name, size, mtime) for every version of key"""
+        descriptor, task, ext = key
+        with self._connect() as db:
+            return db.execute(
+                'SELECT ver, name, size, mtime FROM scenes WHERE dir = ? '
+                'AND descriptor = ? AND task = ? AND ext = ? ORDER BY ver',
+                (scene_versions.folder_key(folder), descriptor, task,
+                 ext)).fetchall()
+
+    def latest_versions(self):
+        """Return the newest version of every scene in the project.
+
+        Rows are (folder, descriptor, task, ext, ver, name, size, mtime).
+        """
+        with self._connect() as db:
+            return db.execute(
+                'SELECT dir, descriptor, task, ext, ver, name, size, mtime '
+                'FROM scenes JOIN (SELECT dir, descriptor, task, ext, '
+                'MAX(ver) AS ver FROM scenes '
+                'GROUP BY dir, descriptor, task, ext) '
+                'USING (dir, descriptor, task, ext, ver) '
+                'ORDER BY dir, descriptor, task, ext, name').fetchall()
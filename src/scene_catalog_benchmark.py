@@ -0,0 +1,125 @@
+"""Compare walking a scenes tree with querying the scene catalog.
+
+    python scene_catalog_benchmark.py --dirs 500 --files 40 --json out.json
+
+A synthetic project is built in a temporary folder. This times a full
+os.walk for the latest version of every scene, the first catalog build,
+refreshes with nothing and with a few folders changed, and queries.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import scene_catalog
+import scene_versions
+
+QUERIES = 1000
+
+
+def build_tree(root, dirs, files):
+    """Create dirs shot folders holding files scene versions each"""
+    folders = []
+    for idx in range(dirs):
+        folder = os.path.join(root, 'seq{:02d}'.format(idx // 50),
+                              'shot{:04d}'.format(idx))
+        os.makedirs(folder)
+        for ver in range(1, files + 1):
+            task = ('model', 'rig', 'anim', 'light')[ver % 4]
+            name = 'shot{:04d}_{}_v{:03d}.ma'.format(idx, task, ver)
+            with open(os.path.join(folder, name), 'w') as scene_file:
+                scene_file.write('//Maya ASCII\n')
+        folders.append(folder)
+    return folders
+
+
+def walk_latest(root):
+    """Return the latest version of every scene by walking the tree"""
+    latest = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            parsed = scene_versions.parse_scene_name(name)
+            if parsed:
+                key = (folder,) + parsed[0]
+                os.stat(os.path.join(folder, name))
+                latest[key] = max(latest.get(key, 0), parsed[1])
+    return latest
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def run(options):
+    """Time each operation and return a list of result dicts"""
+    work = tempfile.mkdtemp(prefix='scene_catalog_bench')
+    try:
+        root = os.path.join(work, 'scenes')
+        folders = build_tree(root, options.dirs, options.files)
+        catalog = scene_catalog.SceneCatalog(
+            root, os.path.join(work, 'catalog.sqlite'), options.threads)
+        results = []
+
+        def add(stage, seconds, items):
+            results.append({'stage': stage, 'seconds': seconds,
+                            'items': items})
+
+        seconds, latest = timed(walk_latest, root)
+        add('os.walk', seconds, len(latest))
+        seconds, listed = timed(catalog.refresh)
+        add('first refresh', seconds, listed)
+        # Let the folders age past the racy window so they count as clean
+        time.sleep(scene_versions.RACY_SECONDS + 0.5)
+        catalog.refresh()
+        seconds, listed = timed(catalog.refresh)
+        add('unchanged refresh', seconds, listed)
+
+        for folder in folders[::max(len(folders) // options.changed, 1)]:
+            name = os.path.basename(folder) + '_model_v999.ma'
+            open(os.path.join(folder, name), 'w').close()
+        seconds, listed = timed(catalog.refresh)
+        add('changed refresh', seconds, listed)
+
+        seconds, rows = timed(catalog.latest_versions)
+        add('latest_versions', seconds, len(rows))
+        key = (os.path.basename(folders[0]), 'model', '.ma')
+        start = time.time()
+        for _ in range(QUERIES):
+            catalog.latest(folders[0], key)
+        add('latest', (time.time() - start) / QUERIES, 1)
+        return results
+    finally:
+        shutil.rmtree(work)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark scene_catalog against walking the tree")
+    parser.add_argument('--dirs', type=int, default=500,
+                        help="number of shot folders")
+    parser.add_argument('--files', type=int, default=40,
+                        help="scene versions per folder")
+    parser.add_argument('--changed', type=int, default=5,
+                        help="folders to add a version to before a refresh")
+    parser.add_argument('--threads', type=int,
+                        default=scene_catalog.SCAN_THREADS)
+    parser.add_argument('--json', help="also write the results to this file")
+    options = parser.parse_args(argv)
+
+    results = run(options)
+    print('{:<20} {:>10} {:>8}'.format('stage', 'seconds', 'items'))
+    for result in results:
+        print('{:<20} {:>10.4f} {:>8}'.format(
+            result['stage'], result['seconds'], result['items']))
+
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Claim scene version numbers so concurrent savers never share one.
+
+A version is claimed by creating a placeholder with O_CREAT | O_EXCL in a
+hidden folder next to the scenes, which only one process can do even
+across machines sharing the filesystem. A per-scene hint file holds the
+last number claimed, so the next claim starts there instead of listing
+the folder; losing a race costs one more create attempt.
+
+Placeholders are never locked, so a saver that dies leaves nothing to
+recover: its number is simply skipped.
+"""
+import errno
+import os
+import socket
+import time
+
+import scene_store
+
+RESERVE_FOLDER = '.reservations'
+MAX_ATTEMPTS = 100000
+
+
+def scene_name(key, ver):
+    descriptor, task, ext = key
+    return '{}_{}_v{:03d}{}'.format(descriptor, task, ver, ext)
+
+
+def hint_path(folder, key):
+    descriptor, task, ext = key
+    return os.path.join(str(folder), RESERVE_FOLDER,
+                        '{}_{}{}.next'.format(descriptor, task, ext))
+
+
+def read_hint(path):
+    """Return the last claimed version recorded at path, 0 if unknown"""
+    try:
+        with open(path) as hint_file:
+            return int(hint_file.read().strip() or 0)
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def write_hint(path, ver):
+    """Record ver as the last claimed version, if it moves the hint on"""
+    if read_hint(path) >= ver:
+        return
+    temp_path = scene_store.temp_name(path)
+    try:
+        with open(temp_path, 'w') as hint_file:
+            hint_file.write(str(ver))
+        scene_store.replace_file(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def claim(path):
+    """Create path exclusively; return False if it already exists"""
+    try:
+        handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except OSError as err:
+        if err.errno == errno.EEXIST:
+            return False
+        raise
+    try:
+        owner = '{} {} {}\n'.format(socket.gethostname(), os.getpid(),
+                                    time.time())
+        os.write(handle, owner.encode('utf-8'))
+    finally:
+        os.close(handle)
+    return True
+
+
+def is_saved(folder, key, ver):
+    """Return whether the version exists as a scene or stored manifest"""
+    path = os.path.join(str(folder), scene_name(key, ver))
+    return (os.path.exists(path) or
+            os.path.exists(path + scene_store.MANIFEST_SUFFIX))
+
+
+def reserve(folder, key, first=None):
+    """Claim the next free version of key in folder.
+
+    Return (version, placeholder path, create attempts). Every save moves
+    the hint on through advance_hint(), so a claim never lists the
+    folder; first is called for a starting version only when no hint
+    exists yet, e.g. in a folder saved before reservations were used.
+    """
+    reserve_folder = os.path.join(str(folder), RESERVE_FOLDER)
+    if not os.path.isdir(reserve_folder):
+        try:
+            os.makedirs(reserve_folder)
+        except OSError:
+            if not os.path.isdir(reserve_folder):
+                raise
+    hint = hint_path(folder, key)
+    ver = read_hint(hint) + 1
+    if ver == 1 and first is not None:
+        ver = max(first(), 1)
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        placeholder = os.path.join(reserve_folder, scene_name(key, ver))
+        # A taken version with no placeholder was saved without a claim;
+        # the placeholder is kept so nobody checks it again.
+        if claim(placeholder) and not is_saved(folder, key, ver):
+            write_hint(hint, ver)
+            return ver, placeholder, attempt
+        ver = max(ver + 1, read_hint(hint) + 1)
+    raise RuntimeError("No free version of {} in {} after {} attempts"
+                       .format(scene_name(key, ver), folder, MAX_ATTEMPTS))
+
+
+def advance_hint(folder, key, ver):
+    """Move the hint past a version about to be saved, claimed or not"""
+    write_hint(hint_path(folder, key), ver)
+
+
+def release(placeholder):
+    """Give back a claimed version that was never saved"""
+    try:
+        os.remove(placeholder)
+    except OSError:
+        pass
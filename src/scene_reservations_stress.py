@@ -0,0 +1,129 @@
+"""Stress version reservation with many concurrent saving processes.
+
+    python scene_reservations_stress.py --processes 32 --saves 50
+
+Every process increments the same scene in a temporary folder as fast as
+it can, writing its name into each version it saves. With --mode scan
+the processes pick max + 1 from a directory listing instead, showing the
+collisions reservations prevent. Claims go through the same
+reserve(first=...) call and version index SceneFile.increment_save uses,
+and the directory entries read per claim are reported. Exits non-zero if
+any save was lost.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import scene_reservations
+import scene_versions
+
+KEY = ('main', 'model', '.ma')
+
+
+def saver(folder, mode, saves, worker, go, results):
+    """Save saves versions of KEY and report what was claimed"""
+    index = scene_versions.VersionIndex()
+    entries = [0]
+
+    def next_avail_ver():
+        latest, read = index.latest(folder, KEY)
+        entries[0] += read
+        return latest + 1
+
+    go.wait()
+    claimed = []
+    attempts = 0
+    for _ in range(saves):
+        if mode == 'reserve':
+            ver, _, tries = scene_reservations.reserve(folder, KEY,
+                                                       first=next_avail_ver)
+            attempts += tries
+        else:
+            ver = next_avail_ver()
+            attempts += 1
+        # What SceneFile.save() does before writing
+        scene_reservations.advance_hint(folder, KEY, ver)
+        path = os.path.join(folder, scene_reservations.scene_name(KEY, ver))
+        with open(path, 'w') as scene_file:
+            scene_file.write('{} {}\n'.format(worker, ver))
+        index.record(folder, KEY, ver)
+        claimed.append(ver)
+    results.put((worker, claimed, attempts, entries[0]))
+
+
+def run(options):
+    """Run every saver at once and return a summary dict"""
+    folder = tempfile.mkdtemp(prefix='scene_reservations_stress')
+    try:
+        go = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(
+            target=saver,
+            args=(folder, options.mode, options.saves, idx, go, results))
+            for idx in range(options.processes)]
+        for worker in workers:
+            worker.start()
+        start = time.time()
+        go.set()
+        reports = [results.get() for _ in workers]
+        seconds = time.time() - start
+        for worker in workers:
+            worker.join()
+
+        claims = {}
+        for worker, claimed, _, _ in reports:
+            for ver in claimed:
+                claims.setdefault(ver, []).append(worker)
+        lost = 0
+        for ver, owners in claims.items():
+            path = os.path.join(folder, scene_reservations.scene_name(KEY,
+                                                                      ver))
+            with open(path) as scene_file:
+                writer = int(scene_file.read().split()[0])
+            lost += len(owners) - (writer in owners)
+        total = options.processes * options.saves
+        return {'mode': options.mode, 'processes': options.processes,
+                'saves': total, 'versions': len(claims),
+                'lost_saves': lost,
+                'duplicate_claims': total - len(claims),
+                'create_attempts': sum(report[2] for report in reports),
+                'entries_read_per_claim':
+                    sum(report[3] for report in reports) / float(total),
+                'seconds': seconds,
+                'saves_per_second': total / seconds if seconds else 0.0}
+    finally:
+        shutil.rmtree(folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run concurrent savers against one scene folder")
+    parser.add_argument('--processes', type=int, default=32)
+    parser.add_argument('--saves', type=int, default=50,
+                        help="versions each process saves")
+    parser.add_argument('--mode', default='reserve',
+                        choices=['reserve', 'scan'])
+    parser.add_argument('--json', help="also write the results to this file")
+    options = parser.parse_args(argv)
+
+    result = run(options)
+    for name in ('mode', 'processes', 'saves', 'versions', 'lost_saves',
+                 'duplicate_claims', 'create_attempts',
+                 'entries_read_per_claim', 'seconds',
+                 'saves_per_second'):
+        print('{:<24} {}'.format(name, result[name]))
+
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(result, json_file, indent=2)
+    if result['lost_saves']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Deduplicated storage of scene versions in content-defined chunks.
+
+Files are cut where a rolling hash of the last WINDOW bytes hits a mask,
+so an edit only changes the chunks around it. Each unique chunk is stored
+once, zlib-compressed under its sha256 in a project-level ChunkStore, and
+a version becomes a small JSON manifest listing its chunks.
+"""
+import hashlib
+import json
+import os
+import struct
+import uuid
+import zlib
+
+import numpy as np
+
+MANIFEST_SUFFIX = '.manifest'
+WINDOW = 32
+MIN_CHUNK = 16 * 1024
+AVG_BITS = 16
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 16 * 1024 * 1024
+GEAR = np.array([struct.unpack('<I', hashlib.md5(struct.pack('B', idx))
+                               .digest()[:4])[0] for idx in range(256)],
+                dtype=np.uint32)
+
+
+def rolling_hashes(data):
+    """Return the gear hash of the WINDOW bytes ending at each position"""
+    hashes = GEAR[data]
+    width = 1
+    while width < WINDOW:
+        hashes[width:] += hashes[:-width] << np.uint32(width)
+        width *= 2
+    return hashes
+
+
+def iter_chunks(stream, min_size=MIN_CHUNK, avg_bits=AVG_BITS,
+                max_size=MAX_CHUNK, read_size=READ_SIZE):
+    """Yield the content-defined chunks of a binary stream"""
+    mask = np.uint32(((1 << avg_bits) - 1) << (32 - avg_bits))
+    pending = b''
+    context = b''
+    while True:
+        block = stream.read(read_size)
+        if not block:
+            break
+        data = np.frombuffer(context + block, dtype=np.uint8)
+        hashes = rolling_hashes(data)[len(context):]
+        cuts = np.flatnonzero((hashes & mask) == 0) + 1 + len(pending)
+
+        buffer = pending + block
+        start = 0
+        for cut in cuts.tolist():
+            while cut - start > max_size:
+                yield buffer[start:start + max_size]
+                start += max_size
+            if cut - start >= min_size:
+                yield buffer[start:cut]
+                start = cut
+        while len(buffer) - start > max_size:
+            yield buffer[start:start + max_size]
+            start += max_size
+        pending = buffer[start:]
+        context = (context + block)[-(WINDOW - 1):]
+    if pending:
+        yield pending
+
+
+def temp_name(path):
+    return '{}.tmp{}'.format(path, uuid.uuid4().hex[:8])
+
+
+def replace_file(temp_path, path):
+    """Move temp_path over path, atomically where the OS allows it"""
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, path)
+        return
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+def write_atomic(path, data):
+    """Write data to path through a temporary file and a rename"""
+    temp_path = temp_name(path)
+    with open(temp_path, 'wb') as out_file:
+        out_file.write(data)
+    replace_file(temp_path, path)
+
+
+class ChunkStore(object):
+    """A folder of compressed chunks shared by every stored version"""
+
+    def __init__(self, root, level=6):
+        self.root = str(root)
+        self.level = level
+
+    def chunk_path(self, digest):
+        return os.path.join(self.root, 'chunks', digest[:2], digest[2:])
+
+    def put_chunk(self, chunk):
+        """Store chunk unless present; return its digest and bytes written"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        data = zlib.compress(chunk, self.level)
+        write_atomic(path, data)
+        return digest, len(data)
+
+    def ingest(self, source, manifest_path):
+        """Chunk the file at source and write its manifest; return stats"""
+        whole = hashlib.sha256()
+        chunks = []
+        size = written = new_chunks = 0
+        with open(str(source), 'rb') as in_file:
+            for chunk in iter_chunks(in_file):
+                whole.update(chunk)
+                digest, stored = self.put_chunk(chunk)
+                chunks.append([digest, len(chunk)])
+                size += len(chunk)
+                if stored:
+                    written += stored
+                    new_chunks += 1
+
+        manifest = {'format': 1, 'size': size, 'sha256': whole.hexdigest(),
+                    'chunks': chunks}
+        write_atomic(str(manifest_path),
+                     json.dumps(manifest, separators=(',', ':'))
+                     .encode('utf-8'))
+        return {'size': size, 'chunks': len(chunks), 'written': written,
+                'new_chunks': new_chunks}
+
+    def restore(self, manifest_path, destination):
+        """Rebuild the exact bytes a manifest describes into destination"""
+        with open(str(manifest_path), 'rb') as manifest_file:
+            manifest = json.loads(manifest_file.read().decode('utf-8'))
+
+        whole = hashlib.sha256()
+        temp_path = temp_name(destination)
+        try:
+            with open(temp_path, 'wb') as out_file:
+                for digest, size in manifest['chunks']:
+                    with open(self.chunk_path(digest), 'rb') as chunk_file:
+                        chunk = zlib.decompress(chunk_file.read())
+                    if len(chunk) != size:
+                        raise IOError("Chunk {} is damaged".format(digest))
+                    whole.update(chunk)
+                    out_file.write(chunk)
+            if whole.hexdigest() != manifest['sha256']:
+                raise IOError("{} did not restore to its original contents"
+                              .format(manifest_path))
+        except Exception:
+            os.remove(temp_path)
+            raise
+        replace_file(temp_path, str(destination))
+        return manifest['size']
+
+    def disk_usage(self):
+        """Return the bytes used by every stored chunk"""
+        total = 0
+        for folder, _, names in os.walk(os.path.join(self.root, 'chunks')):
+            total += sum(os.path.getsize(os.path.join(folder, name))
+                         for name in names)
+        return total
@@ -0,0 +1,135 @@
+"""Compare full scene copies with the deduplicating scene_store.
+
+    python scene_store_benchmark.py --size-mb 200 --versions 10 --json out.json
+
+A synthetic Maya ASCII scene is saved as a series of versions, each with
+a few small edits, once as full copies and once into a ChunkStore. This
+reports the disk used by each and the save and restore latency.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import scene_store
+
+
+def write_scene(path, size, seed):
+    """Write roughly size bytes of .ma-like text to path"""
+    rng = random.Random(seed)
+    with open(path, 'w') as scene_file:
+        scene_file.write('//Maya ASCII 2020 scene\nrequires maya "2020";\n')
+        written = 0
+        node = 0
+        while written < size:
+            lines = ['createNode transform -n "node{}";\n'.format(node),
+                     '\tsetAttr ".t" -type "double3" {:.6f} {:.6f} {:.6f};\n'
+                     .format(rng.uniform(-100, 100), rng.uniform(-100, 100),
+                             rng.uniform(-100, 100))]
+            text = ''.join(lines)
+            scene_file.write(text)
+            written += len(text)
+            node += 1
+
+
+def edit_scene(path, edits, seed):
+    """Overwrite a few short runs of the file, like moving some nodes"""
+    rng = random.Random(seed)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as scene_file:
+        for _ in range(edits):
+            scene_file.seek(rng.randrange(size - 16))
+            scene_file.write('{:016d}'.format(rng.randrange(10 ** 16))
+                             .encode('ascii'))
+
+
+def folder_size(folder):
+    total = 0
+    for root, _, names in os.walk(folder):
+        total += sum(os.path.getsize(os.path.join(root, name))
+                     for name in names)
+    return total
+
+
+def run(options):
+    """Save every version both ways and return a dict of results"""
+    work = tempfile.mkdtemp(prefix='scene_store_bench')
+    try:
+        scene = os.path.join(work, 'work.ma')
+        copies = os.path.join(work, 'copies')
+        manifests = os.path.join(work, 'manifests')
+        os.makedirs(copies)
+        os.makedirs(manifests)
+        store = scene_store.ChunkStore(os.path.join(work, 'store'))
+        write_scene(scene, int(options.size_mb * 1048576), options.seed)
+
+        copy_times, store_times = [], []
+        for ver in range(1, options.versions + 1):
+            if ver > 1:
+                edit_scene(scene, options.edits, options.seed + ver)
+            name = 'main_model_v{:03d}.ma'.format(ver)
+
+            start = time.time()
+            shutil.copy(scene, os.path.join(copies, name))
+            copy_times.append(time.time() - start)
+
+            start = time.time()
+            store.ingest(scene, os.path.join(
+                manifests, name + scene_store.MANIFEST_SUFFIX))
+            store_times.append(time.time() - start)
+
+        restored = os.path.join(work, 'restored.ma')
+        start = time.time()
+        store.restore(os.path.join(manifests, name +
+                                   scene_store.MANIFEST_SUFFIX), restored)
+        restore_seconds = time.time() - start
+        start = time.time()
+        shutil.copy(os.path.join(copies, name), restored)
+        copy_restore_seconds = time.time() - start
+
+        return {'size_mb': options.size_mb, 'versions': options.versions,
+                'edits': options.edits,
+                'copy_bytes': folder_size(copies),
+                'store_bytes': store.disk_usage() + folder_size(manifests),
+                'copy_save_seconds': copy_times,
+                'store_save_seconds': store_times,
+                'copy_restore_seconds': copy_restore_seconds,
+                'store_restore_seconds': restore_seconds}
+    finally:
+        shutil.rmtree(work)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark scene_store against full copies")
+    parser.add_argument('--size-mb', type=float, default=100.0,
+                        help="size of the synthetic scene")
+    parser.add_argument('--versions', type=int, default=10,
+                        help="number of versions to save")
+    parser.add_argument('--edits', type=int, default=20,
+                        help="small edits made between versions")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="also write the results to this file")
+    options = parser.parse_args(argv)
+
+    result = run(options)
+    mb = 1048576.0
+    print('{:<8} {:>10} {:>16} {:>16} {:>12}'.format(
+        'method', 'disk MB', 'first save s', 'later save s', 'restore s'))
+    for method in ('copy', 'store'):
+        saves = result[method + '_save_seconds']
+        later = saves[1:] or saves
+        print('{:<8} {:>10.1f} {:>16.3f} {:>16.3f} {:>12.3f}'.format(
+            method, result[method + '_bytes'] / mb, saves[0],
+            sum(later) / len(later), result[method + '_restore_seconds']))
+
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(result, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import errno
+import logging
+import os
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# mtime of the last file each Upload published, by destination
+_published = {}
+_published_lock = threading.Lock()
+
+
+def file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def publish(temp_path, path):
+    """Atomically move temp_path over path"""
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, path)
+        return
+    try:
+        os.rename(temp_path, path)
+    except OSError as err:
+        # Python 2 on Windows cannot rename over an existing file
+        if err.errno != errno.EEXIST:
+            raise
+        os.remove(path)
+        os.rename(temp_path, path)
+
+
+class Upload(object):
+    """Copy a locally saved file to its destination on a background thread.
+
+    The copy is written next to the destination under a temporary name and
+    renamed into place once complete, so an interrupted upload never
+    leaves a truncated file at the destination. An upload started with
+    after=other waits for other to finish first, so saves publish in the
+    order they were made. If something other than an Upload writes the
+    destination after start(), e.g. a native save, the older copy is not
+    published over it and the local copy is kept.
+    """
+
+    PENDING = 'pending'
+    COPYING = 'copying'
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, source, destination, after=None, remove_source=True,
+                 chunk_size=CHUNK_SIZE):
+        self.source = str(source)
+        self.destination = str(destination)
+        self.after = after
+        self.remove_source = remove_source
+        self.chunk_size = chunk_size
+        self.state = self.PENDING
+        self.error = None
+        self.copied = 0
+        self.total = os.path.getsize(self.source)
+        self.started = None
+        self.finished = None
+        self.baseline_mtime = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='upload ' + self.destination)
+        self._thread.daemon = True
+
+    def start(self):
+        self.started = time.time()
+        self.baseline_mtime = file_mtime(self.destination)
+        self.state = self.COPYING
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Block until the upload ends; return whether it succeeded"""
+        self._thread.join(timeout)
+        return self.state == self.DONE
+
+    @property
+    def active(self):
+        return self.state in (self.PENDING, self.COPYING)
+
+    def superseded(self):
+        """Return whether another writer changed the destination"""
+        current = file_mtime(self.destination)
+        with _published_lock:
+            ours = _published.get(self.destination)
+        return current is not None and current not in (self.baseline_mtime,
+                                                        ours)
+
+    @property
+    def progress(self):
+        return float(self.copied) / self.total if self.total else 1.0
+
+    @property
+    def rate(self):
+        """Return the average transfer rate in bytes per second"""
+        elapsed = (self.finished or time.time()) - (self.started or 0.0)
+        return self.copied / elapsed if elapsed > 0 else 0.0
+
+    def _run(self):
+        if self.after is not None:
+            self.after.wait()
+            self.after = None
+        temp_path = '{}.part{}'.format(self.destination, uuid.uuid4().hex[:8])
+        try:
+            folder = os.path.dirname(self.destination)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(self.source, 'rb') as src, open(temp_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    self.copied += len(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            if self.superseded():
+                os.remove(temp_path)
+                self.state = self.SKIPPED
+                log.warning("%s changed since it was queued for upload; "
+                            "kept the older local copy at %s instead of "
+                            "publishing it", self.destination, self.source)
+                self.finished = time.time()
+                return
+            publish(temp_path, self.destination)
+            with _published_lock:
+                _published[self.destination] = file_mtime(self.destination)
+        except Exception as err:
+            self.error = str(err)
+            self.state = self.FAILED
+            log.error("Upload of %s failed, local copy kept at %s: %s",
+                      self.destination, self.source, err)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        else:
+            self.state = self.DONE
+            if self.remove_source:
+                os.remove(self.source)
+                try:
+                    os.rmdir(os.path.dirname(self.source))
+                except OSError:
+                    pass
+        self.finished = time.time()
+
+    def describe(self):
+        """Return a one-line status for display"""
+        name = os.path.basename(self.destination)
+        if self.state == self.DONE:
+            return "Published {}".format(name)
+        if self.state == self.FAILED:
+            return "Upload of {} failed: {}".format(name, self.error)
+        if self.state == self.SKIPPED:
+            return "Skipped {}: a newer file was saved there".format(name)
+        return "Uploading {} {:.0%} ({:.1f} MB/s)".format(
+            name, self.progress, self.rate / 1048576.0)
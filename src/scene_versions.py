@@ -0,0 +1,123 @@
+import bisect
+import os
+import re
+import time
+
+# Versions kept in a scene_store.ChunkStore appear as '<name>.manifest'
+SCENE_NAME_RE = re.compile(r'^(?P<descriptor>[^_]+)_(?P<task>[^_]+)'
+                           r'_v(?P<ver>\d+)(?P<ext>\.[^.]+)(\.manifest)?$')
+
+# A folder changed this soon after its mtime could change again without
+# the mtime moving on filesystems with coarse timestamps, so rescan it.
+RACY_SECONDS = 2.0
+
+
+def parse_scene_name(name):
+    """Return ((descriptor, task, ext), version) or None for other files"""
+    match = SCENE_NAME_RE.match(name)
+    if not match:
+        return None
+    key = (match.group('descriptor'), match.group('task'),
+           match.group('ext'))
+    return key, int(match.group('ver'))
+
+
+def folder_key(folder):
+    return os.path.normcase(os.path.abspath(str(folder)))
+
+
+def folder_mtime(folder):
+    """Return the mtime of folder, or None when it does not exist"""
+    try:
+        return os.stat(folder).st_mtime
+    except OSError:
+        return None
+
+
+class FolderIndex(object):
+    """Sorted version numbers per (descriptor, task, ext) in one folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.mtime = None
+        self.racy = True
+        self.versions = {}
+
+    def is_current(self):
+        """Return whether the folder is unchanged since the last scan"""
+        return not self.racy and folder_mtime(self.folder) == self.mtime
+
+    def scan(self):
+        """Rebuild the index in one directory pass; return entries read"""
+        scanned_at = time.time()
+        self.mtime = folder_mtime(self.folder)
+        self.racy = (self.mtime is not None and
+                     scanned_at - self.mtime <= RACY_SECONDS)
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            names = []
+
+        versions = {}
+        for name in names:
+            parsed = parse_scene_name(name)
+            if parsed:
+                versions.setdefault(parsed[0], []).append(parsed[1])
+        for numbers in versions.values():
+            numbers.sort()
+        self.versions = versions
+        return len(names)
+
+    def refresh(self):
+        """Rescan if the folder changed; return entries read"""
+        if self.is_current():
+            return 0
+        return self.scan()
+
+    def latest(self, key):
+        """Return the highest version of key, 0 when there is none"""
+        numbers = self.versions.get(key)
+        return numbers[-1] if numbers else 0
+
+    def add(self, key, ver, mtime_before=None):
+        """Record a version this process just wrote.
+
+        mtime_before is the folder's mtime just before the write. Only when
+        it still matches the last scan is the folder's new mtime trusted to
+        come from this write; otherwise another machine may have saved
+        versions too, and the next lookup rescans.
+        """
+        numbers = self.versions.setdefault(key, [])
+        idx = bisect.bisect_left(numbers, ver)
+        if idx == len(numbers) or numbers[idx] != ver:
+            numbers.insert(idx, ver)
+        if (self.mtime is not None and not self.racy and
+                mtime_before == self.mtime):
+            self.mtime = folder_mtime(self.folder)
+
+
+class VersionIndex(object):
+    """FolderIndex objects for every folder looked at this session"""
+
+    def __init__(self):
+        self.folders = {}
+
+    def folder(self, folder):
+        """Return the FolderIndex of folder, creating it if needed"""
+        key = folder_key(folder)
+        if key not in self.folders:
+            self.folders[key] = FolderIndex(key)
+        return self.folders[key]
+
+    def latest(self, folder, key):
+        """Return the latest version of key in folder and entries read"""
+        index = self.folder(folder)
+        read = index.refresh()
+        return index.latest(key), read
+
+    def record(self, folder, key, ver, mtime_before=None):
+        """Add a version written by this process to the index"""
+        self.folder(folder).add(key, ver, mtime_before)
+
+
+VERSION_INDEX = VersionIndex()
@@ -1,12 +1,25 @@
+import hashlib
 import logging
+import tempfile
+import threading
+import uuid
+
 import pymel.core as pmc
 from pymel.core.system import Path
 
 from PySide2 import QtWidgets, QtCore
 from shiboken2 import wrapInstance
+import maya.api.OpenMaya as om
 import maya.OpenMayaUI as omui
 import maya.cmds as cmds
 
+import profiling
+import scene_catalog
+import scene_reservations
+import scene_store
+import scene_upload
+import scene_versions
+
 log = logging.getLogger(__name__)
 
 
@@ -16,6 +29,28 @@ def maya_main_window():
     return wrapInstance(long(main_window), QtWidgets.QWidget)
 
 
+def confirm_pending_uploads(uploads):
+    """Ask what to do about unfinished uploads; return False to stay"""
+    if not uploads:
+        return True
+    answer = cmds.confirmDialog(
+        title="Smart Save",
+        message="{} background upload(s) have not finished. Closing now "
+                "leaves them unpublished.".format(len(uploads)),
+        button=["Wait", "Close Anyway", "Cancel"], defaultButton="Wait",
+        cancelButton="Cancel", dismissString="Cancel")
+    if answer == "Cancel":
+        return False
+    if answer == "Wait":
+        for upload in uploads:
+            upload.wait()
+    else:
+        for upload in uploads:
+            log.warning("Upload of %s abandoned; local copy at %s",
+                        upload.destination, upload.source)
+    return True
+
+
 class SmartSaveUI(QtWidgets.QDialog):
     """Smart Save UI Class"""
 
@@ -27,8 +62,14 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.setWindowFlags(self.windowFlags() ^
                             QtCore.Qt.WindowContextHelpButtonHint)
         self.scene_file = SceneFile()
+        self.scene_file.catalog = scene_catalog.SceneCatalog(
+            Path(cmds.workspace(query=True, rootDirectory=True)) / "scenes")
+        self.upload_timer = QtCore.QTimer(self)
+        self.catalog_timer = QtCore.QTimer(self)
+        self.catalog_thread = None
         self.create_ui()
         self.create_connections()
+        self._refresh_catalog()
 
     def create_ui(self):
         self.title_lbl = QtWidgets.QLabel("Smart Save")
@@ -52,6 +93,11 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.folder_browse_btn.clicked.connect(self._browse_dir)
         self.save_btn.clicked.connect(self._save)
         self.save_increment_btn.clicked.connect(self._save_increment)
+        self.upload_timer.timeout.connect(self._show_upload_status)
+        self.catalog_timer.timeout.connect(self._check_catalog)
+        self.folder_le.textChanged.connect(self._show_latest)
+        self.descriptor_le.textChanged.connect(self._show_latest)
+        self.task_le.textChanged.connect(self._show_latest)
 
     @QtCore.Slot()
     def _cancel(self):
@@ -74,6 +120,7 @@ class SmartSaveUI(QtWidgets.QDialog):
         """Save the file as is"""
         self._set_scenefile_properties_from_ui()
         self.scene_file.save()
+        self._watch_uploads()
 
     @QtCore.Slot()
     def _save_increment(self):
@@ -81,6 +128,61 @@ class SmartSaveUI(QtWidgets.QDialog):
         self._set_scenefile_properties_from_ui()
         self.scene_file.increment_save()
         self.version_sbx.setValue(self.scene_file.ver)
+        self._watch_uploads()
+
+    def closeEvent(self, event):
+        """Let the artist wait for background uploads before closing"""
+        if not confirm_pending_uploads(self.scene_file.pending_uploads()):
+            event.ignore()
+            return
+        self.upload_timer.stop()
+        self.scene_file.finish_uploads()
+        self.scene_file.remove_exit_check()
+        super(SmartSaveUI, self).closeEvent(event)
+
+    def _watch_uploads(self):
+        if self.scene_file.uploads:
+            self._show_upload_status()
+            self.upload_timer.start(250)
+
+    @QtCore.Slot()
+    def _show_upload_status(self):
+        """Show the state of the latest background upload"""
+        self.scene_file.finish_uploads()
+        uploads = self.scene_file.uploads
+        active = [upload for upload in uploads if upload.active]
+        message = uploads[-1].describe()
+        if len(active) > 1:
+            message += " ({} uploads queued)".format(len(active))
+        self.upload_lbl.setText(message)
+        if not active:
+            self.upload_timer.stop()
+
+    def _refresh_catalog(self):
+        """Update the project catalog on a thread, keeping the UI live"""
+        self._show_latest()
+        self.catalog_thread = threading.Thread(
+            target=self.scene_file.catalog.refresh, name='scene catalog')
+        self.catalog_thread.daemon = True
+        self.catalog_thread.start()
+        self.catalog_timer.start(250)
+
+    @QtCore.Slot()
+    def _check_catalog(self):
+        if not self.catalog_thread.is_alive():
+            self.catalog_timer.stop()
+            self._show_latest()
+
+    @QtCore.Slot()
+    def _show_latest(self):
+        """Show the latest cataloged version of the scene in the UI"""
+        key = (self.descriptor_le.text(), self.task_le.text(),
+               self.ext_lbl.text())
+        latest = self.scene_file.catalog.latest(self.folder_le.text(), key)
+        if latest:
+            self.latest_lbl.setText("Latest: v{:03d}".format(latest))
+        else:
+            self.latest_lbl.setText("No saved versions")
 
     def _set_scenefile_properties_from_ui(self):
         self.scene_file.folder_path = self.folder_le.text()
@@ -88,15 +190,23 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.scene_file.task = self.task_le.text()
         self.scene_file.ver = self.version_sbx.value()
         self.scene_file.ext = self.ext_lbl.text()
+        self.scene_file.background_upload = self.background_cb.isChecked()
 
     def _create_button_ui(self):
         self.save_btn = QtWidgets.QPushButton("Save")
         self.save_increment_btn = QtWidgets.QPushButton("Save Increment")
         self.cancel_btn = QtWidgets.QPushButton("Cancel")
-        layout = QtWidgets.QHBoxLayout()
-        layout.addWidget(self.save_btn)
-        layout.addWidget(self.save_increment_btn)
-        layout.addWidget(self.cancel_btn)
+        self.background_cb = QtWidgets.QCheckBox("Upload in background")
+        self.background_cb.setChecked(self.scene_file.background_upload)
+        self.upload_lbl = QtWidgets.QLabel("")
+        btn_lay = QtWidgets.QHBoxLayout()
+        btn_lay.addWidget(self.background_cb)
+        btn_lay.addWidget(self.save_btn)
+        btn_lay.addWidget(self.save_increment_btn)
+        btn_lay.addWidget(self.cancel_btn)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.upload_lbl)
+        layout.addLayout(btn_lay)
         return layout
 
     def _create_filename_ui(self):
@@ -111,6 +221,7 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.version_sbx.setFixedWidth(70)
         self.version_sbx.setButtonSymbols(QtWidgets.QAbstractSpinBox.PlusMinus)
         self.ext_lbl = QtWidgets.QLabel(".ma")
+        self.latest_lbl = QtWidgets.QLabel("")
 
         layout.addWidget(self.descriptor_le, 1, 0)
         layout.addWidget(QtWidgets.QLabel("_"), 1, 1)
@@ -118,6 +229,7 @@ class SmartSaveUI(QtWidgets.QDialog):
         layout.addWidget(QtWidgets.QLabel("_V"), 1, 3)
         layout.addWidget(self.version_sbx, 1, 4)
         layout.addWidget(self.ext_lbl, 1, 5)
+        layout.addWidget(self.latest_lbl, 2, 4)
         return layout
 
     def _create_filename_headers(self):
@@ -154,6 +266,15 @@ class SceneFile(object):
         self.task = "model"
         self.ver = 1
         self.ext = ".ma"
+        self.profiler = profiling.Profiler('scenefile')
+        self.version_index = scene_versions.VERSION_INDEX
+        self.background_upload = False
+        self.scratch_folder = Path(tempfile.gettempdir()) / "smartsave"
+        self.uploads = []
+        self._unrecorded = []
+        self._exit_check = None
+        self.store = None
+        self.catalog = None
         scene = pmc.system.sceneName()
         if not path and scene:
             path = scene
@@ -182,6 +303,11 @@ class SceneFile(object):
     def path(self):
         return self.folder_path / self.filename
 
+    @property
+    def manifest_path(self):
+        return self.folder_path / (self.filename +
+                                   scene_store.MANIFEST_SUFFIX)
+
     def _init_from_path(self, path):
         path = Path(path)
         self.folder_path = path.parent
@@ -189,36 +315,160 @@ class SceneFile(object):
         self.descriptor, self.task, ver = path.name.stripext().split("_")
         self.ver = int(ver.split("v")[-1])
 
+    @property
+    def version_key(self):
+        return (self.descriptor, self.task, self.ext)
+
+    def new_scratch_path(self):
+        """Return a fresh local path for a background save to write"""
+        folder_hash = hashlib.md5(
+            str(self.folder_path).encode('utf-8')).hexdigest()[:8]
+        return (self.scratch_folder / folder_hash / uuid.uuid4().hex[:8] /
+                self.filename)
+
     def save(self):
         """Saves the scene file"""
+        scene_reservations.advance_hint(self.folder_path, self.version_key,
+                                        self.ver)
+        if self.store is not None:
+            return self.save_to_store()
+        if self.background_upload:
+            return self.save_in_background()
+        mtime_before = scene_versions.folder_mtime(self.folder_path)
         try:
-            return pmc.system.saveAs(self.path)
+            with self.profiler.stage('save_as'):
+                result = pmc.system.saveAs(self.path)
         except RuntimeError as err:
             log.warning("Missing directories in path. Creating directories.")
-            self.folder_path.makedirs_p()
-            return pmc.system.saveAs(self.path)
+            with self.profiler.stage('directories'):
+                self.folder_path.makedirs_p()
+            with self.profiler.stage('save_as'):
+                result = pmc.system.saveAs(self.path)
+        self._record_version(self.path, mtime_before)
+        return result
+
+    def save_in_background(self):
+        """Save to local scratch and upload to the path on a thread.
+
+        The scene keeps the destination path as its name, so later saves
+        and scene file lookups behave as if it had been saved there. The
+        version is indexed by finish_uploads() once the upload is done.
+        """
+        scratch_path = self._save_to_scratch()
+        previous = self.uploads[-1] if self.uploads else None
+        upload = scene_upload.Upload(scratch_path, self.path, after=previous)
+        self.uploads.append(upload)
+        self._unrecorded.append((upload, self.folder_path, self.version_key,
+                                 self.ver))
+        upload.start()
+        if self._exit_check is None:
+            self._exit_check = om.MSceneMessage.addCheckCallback(
+                om.MSceneMessage.kBeforeExitCheck, self._check_exit)
+        return upload
+
+    def save_to_store(self):
+        """Save the scene as a manifest of chunks in self.store.
+
+        Only chunks the store does not hold yet are written, so a new
+        version of a mostly unchanged scene costs a few chunks plus its
+        manifest. Use restore() to get the scene file back.
+        """
+        scratch_path = self._save_to_scratch()
+        mtime_before = scene_versions.folder_mtime(self.folder_path)
+        try:
+            with self.profiler.stage('store_ingest') as stage:
+                self.folder_path.makedirs_p()
+                stats = self.store.ingest(scratch_path, self.manifest_path)
+                stage['items'] = stats['chunks']
+        finally:
+            scratch_path.remove_p()
+            scratch_path.parent.rmdir_p()
+        self._record_version(self.manifest_path, mtime_before)
+        return stats
+
+    def restore(self, destination=None):
+        """Rebuild this version's scene file from the store"""
+        destination = destination or self.path
+        with self.profiler.stage('store_restore'):
+            self.store.restore(self.manifest_path, destination)
+        return destination
+
+    def _save_to_scratch(self):
+        scratch_path = self.new_scratch_path()
+        with self.profiler.stage('scratch_save'):
+            scratch_path.parent.makedirs_p()
+            pmc.system.saveAs(scratch_path)
+            pmc.system.renameFile(self.path)
+        return scratch_path
+
+    def _record_version(self, path, mtime_before=None):
+        """Index a saved version; see scene_versions.FolderIndex.add"""
+        self.version_index.record(self.folder_path, self.version_key,
+                                  self.ver, mtime_before)
+        if self.catalog is not None:
+            self.catalog.record(path)
+
+    def pending_uploads(self):
+        """Return the background uploads that have not finished"""
+        return [upload for upload in self.uploads if upload.active]
+
+    def finish_uploads(self):
+        """Index the background saves that finished uploading.
+
+        Failed and skipped uploads are dropped without being indexed.
+        Once nothing is left uploading the Maya quit check is removed.
+        Returns the uploads still pending.
+        """
+        unrecorded = []
+        for upload, folder, key, ver in self._unrecorded:
+            if upload.active:
+                unrecorded.append((upload, folder, key, ver))
+            elif upload.state == upload.DONE:
+                self.version_index.record(folder, key, ver)
+                if self.catalog is not None:
+                    self.catalog.record(upload.destination)
+        self._unrecorded = unrecorded
+        pending = self.pending_uploads()
+        if not pending:
+            self.remove_exit_check()
+        return pending
+
+    def remove_exit_check(self):
+        """Stop asking about unfinished uploads when Maya quits"""
+        if self._exit_check is not None:
+            om.MMessage.removeCallback(self._exit_check)
+            self._exit_check = None
+
+    def _check_exit(self, client_data=None):
+        """Maya quit check: upload threads die with the process"""
+        return confirm_pending_uploads(self.pending_uploads())
 
     def next_avail_ver(self):
         """Return next available version number in folder."""
-        pattern = "{descriptor}_{task}_v*{ext}".format(
-            descriptor=self.descriptor, task=self.task, ext=self.ext)
-        matching_scenefiles = []
-
-        for file_ in self.folder_path.files():
-            if file_.name.fnmatch(pattern):
-                matching_scenefiles.append(file_)
-
-        if not matching_scenefiles:
-            return 1
-
-        matching_scenefiles.sort(reverse=True)
-        latest_scenefile = matching_scenefiles[0]
-        latest_scenefile = latest_scenefile.name.stripext()
-        latest_ver_num = int(latest_scenefile.split("_v")[-1])
-
-        return latest_ver_num + 1
+        with self.profiler.stage('version_scan') as stage:
+            if self.catalog is not None:
+                stage['items'] = self.catalog.refresh_folder(
+                    self.folder_path)
+                latest = self.catalog.latest(self.folder_path,
+                                             self.version_key)
+            else:
+                latest, stage['items'] = self.version_index.latest(
+                    self.folder_path, self.version_key)
+        return latest + 1
 
     def increment_save(self):
-        """Increments version and saves scene file"""
-        self.ver = self.next_avail_ver()
-        self.save()
+        """Claims the next version and saves scene file.
+
+        The claim is atomic on the shared filesystem, so concurrent savers
+        of the same scene always get different versions.
+        """
+        with self.profiler.stage('version_reserve') as stage:
+            self.ver, placeholder, stage['items'] = \
+                scene_reservations.reserve(self.folder_path,
+                                           self.version_key,
+                                           first=self.next_avail_ver)
+        try:
+            return self.save()
+        except Exception:
+            scene_reservations.release(placeholder)
+            raise